@@ -0,0 +1,267 @@
+import os
+import io
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+from PIL import Image
+import nba
+
+# Benchmark of the report pipeline that runs without API key nor internet:
+# the responses of the SportsData endpoints and the scraped pages are either
+# recorded ones (a cache directory of a previous run) or generated for a
+# synthetic league, and are replayed through an offline ResponseCache.
+
+API = 'https://api.sportsdata.io/v3/nba'
+
+
+def synthetic_logo(color: tuple) -> bytes:
+    """Transparent PNG logo: a colored disc"""
+
+    size = 200
+    (y, x) = np.ogrid[:size, :size]
+    disc = (x - size / 2) ** 2 + (y - size / 2) ** 2 < (size / 2.2) ** 2
+    pixels = np.zeros((size, size, 4), dtype=np.uint8)
+    pixels[disc] = (*color, 255)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels, 'RGBA').save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def synthetic_league(teams: int = 30, players: int = 15, games: int = 82, seasons: int = 1, first_season: int = 2022,
+                     seed: int = 0) -> dict:
+    """Responses (url -> body) of every endpoint and page used by the report, for a synthetic league
+
+    Each team has `players` players and plays about `games` games per season.
+    """
+
+    rnd = random.Random(seed)
+    responses = {}
+
+    df_teams = []
+    for i in range(teams):
+        color = (rnd.randrange(256), rnd.randrange(256), rnd.randrange(256))
+        df_teams.append({'TeamID': i + 1, 'Key': f'T{i:02d}', 'Active': True, 'City': f'City{i:02d}', 'Name': f'Team{i:02d}',
+                         'PrimaryColor': '%02X%02X%02X' % color, 'SecondaryColor': '%02X%02X%02X' % color[::-1]})
+    keys = [team['Key'] for team in df_teams]
+    names = {team['Key']: f"{team['City']} {team['Name']}" for team in df_teams}
+    responses[f'{API}/scores/json/teams'] = df_teams
+
+    # The last player of every team has no college, as the API leaves missing values null
+    roster = []
+    for team in keys:
+        for i in range(players):
+            roster.append({'PlayerID': len(roster) + 1, 'Team': team, 'FirstName': f'First{i:02d}', 'LastName': f'{team}Last{i:02d}',
+                           'Position': rnd.choice(['PG', 'SG', 'SF', 'PF', 'C']), 'Height': rnd.randint(72, 88),
+                           'Weight': rnd.randint(170, 280), 'BirthDate': f'{rnd.randint(1985, 2003)}-0{rnd.randint(1, 9)}-1{rnd.randint(0, 9)}T00:00:00',
+                           'BirthCountry': 'USA', 'College': f'College{rnd.randrange(40)}' if i < players - 1 else None, 'Salary': rnd.randint(1, 45) * 1000000})
+    responses[f'{API}/scores/json/Players'] = roster
+    for team in keys:
+        responses[f'{API}/scores/json/Players/{team}'] = [player for player in roster if player['Team'] == team]
+
+    for season in range(first_season, first_season + seasons):
+        schedule = []
+        for day in range(games * teams // 2):
+            (away, home) = rnd.sample(keys, 2)
+            schedule.append({'GameID': season * 10000 + day, 'Season': season, 'SeasonType': 1, 'Status': 'Final',
+                             'Day': f'{season}-11-01T00:00:00', 'DateTime': f'{season}-11-01T19:30:00',
+                             'AwayTeam': away, 'HomeTeam': home,
+                             'AwayTeamScore': rnd.randint(85, 135), 'HomeTeamScore': rnd.randint(85, 135)})
+        responses[f'{API}/scores/json/Games/{season}'] = schedule
+
+        stats = []
+        for player in roster:
+            two_attempted = rnd.randint(0, 900)
+            three_attempted = rnd.randint(0, 600)
+            two_made = rnd.randint(0, two_attempted)
+            three_made = rnd.randint(0, three_attempted)
+            stats.append({'PlayerID': player['PlayerID'], 'Season': season, 'Team': player['Team'],
+                          'Name': f"{player['FirstName']} {player['LastName']}", 'Position': player['Position'],
+                          'Games': rnd.randint(1, 82), 'Minutes': rnd.randint(20, 3000), 'Points': float(2 * two_made + 3 * three_made),
+                          'TwoPointersMade': float(two_made), 'TwoPointersAttempted': float(two_attempted),
+                          'ThreePointersMade': float(three_made), 'ThreePointersAttempted': float(three_attempted),
+                          'FreeThrowsPercentage': float(rnd.randint(0, 100)), 'Steals': float(rnd.randint(0, 150)),
+                          'BlockedShots': float(rnd.randint(0, 150))})
+        for team in keys:
+            responses[f'{API}/stats/json/PlayerSeasonStatsByTeam/{season}/{team}'] = [row for row in stats if row['Team'] == team]
+
+    # Logo wall of loodibee, with one logo per team
+    images = []
+    for team in df_teams:
+        logo = f'https://loodibee.com/wp-content/uploads/{team["Key"]}.png'
+        responses[logo] = synthetic_logo((rnd.randrange(256), rnd.randrange(256), rnd.randrange(256)))
+        images.append(f'<img alt="{names[team["Key"]]} Transparent Logo" src="{logo}" srcset="{logo} 300w, {logo} 500w">')
+    responses[nba.LOGOS_URL] = f'<html><body><div class="logos-layout column-3">{"".join(images)}</div></body></html>'
+
+    # Odds board of sportytrader, with one match per pair of teams
+    match_class = 'cursor-pointer border rounded-md mb-4 px-1 py-2 flex flex-col lg:flex-row relative'
+    odds_class = 'px-1 h-booklogosm font-bold bg-primary-yellow text-white leading-8 rounded-r-md w-14 md:w-18 flex justify-center items-center text-base'
+    matches = []
+    for i in range(0, teams - 1, 2):
+        (home, away) = (names[keys[i]], names[keys[i + 1]])
+        matches.append(f'<div class="{match_class}"><span><span>{10 + i % 18}/11 02:00</span><a> {home} - {away} </a></span>'
+                       f'<span class="{odds_class}">{rnd.uniform(1.1, 3):.2f}</span><span class="{odds_class}">{rnd.uniform(1.1, 3):.2f}</span></div>')
+    responses[nba.ODDS_URL] = f'<html><body><div class="px-box mb-10">{"".join(matches)}</div></body></html>'
+
+    return {url: body if isinstance(body, bytes) else (body if isinstance(body, str) else json.dumps(body)).encode()
+            for url, body in responses.items()}
+
+
+def record_fixtures(responses: dict, path: str) -> None:
+    """Save the responses in a cache directory that can be replayed offline"""
+
+    cache = nba.ResponseCache(path)
+    for url, body in responses.items():
+        cache.put(url, body)
+
+
+def measure(function, repeat: int) -> dict:
+    """Run a function `repeat` times and return its best and mean wall time"""
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return {'best': min(times), 'mean': sum(times) / len(times)}
+
+
+def startup(fixtures: str, team: str, season: str, repeat: int) -> dict:
+    """Time fresh interpreters: importing nba, printing the CLI help and a fetch-only run"""
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    script = os.path.join(here, 'nba.py')
+    commands = {
+        'import': [sys.executable, '-c', 'import nba'],
+        'cli_help': [sys.executable, script, '--help'],
+        'cli_fetch': [sys.executable, script, team, season, '--stage', 'fetch', '--cache', fixtures, '--offline',
+                      '--output-dir', 'cli'],
+    }
+    return {name: measure(lambda: subprocess.run(command, cwd=here if name == 'import' else None, check=True,
+                                                 stdout=subprocess.DEVNULL), repeat)
+            for name, command in commands.items()}
+
+
+def check_shared(season: str) -> None:
+    """Check that the shared league tables give every team the same chart jobs as split_league_dfs"""
+
+    def jobs(team, dfs):
+        (colors, name) = nba.get_team_info(dfs[3])
+        return (colors, name, [nba.job_hash(job) for job in nba.report_jobs(*dfs[:3], colors, name, team)])
+
+    league_dfs = nba.get_league_dfs(season)
+    league = nba.SharedLeague.create(*league_dfs)
+    try:
+        for team in league_dfs[3]['Key']:
+            # The views of the shared arrays only live in jobs, so the segment can be closed afterwards
+            if jobs(team, league.team_dfs(team)) != jobs(team, nba.split_league_dfs(team, *league_dfs)):
+                raise RuntimeError(f'The shared league tables of {team} differ from split_league_dfs')
+    finally:
+        league.close(unlink=True)
+
+
+def run(fixtures: str, team: str, season: str, repeat: int, workers: int) -> tuple[dict, dict]:
+    """Time every stage of the report for one team and the whole batch, replaying the fixtures
+
+    Returns the timings and the size of the PDF of the team with PNG and
+    with vector charts.
+    """
+
+    results = startup(fixtures, team, season, repeat)
+    nba.cache = nba.ResponseCache(fixtures, max_size=sys.maxsize, offline=True)
+    check_shared(season)
+
+    results['get_dfs'] = measure(lambda: nba.get_dfs(team, season), repeat)
+
+    dfs = nba.get_dfs(team, season)
+    (colors, name) = nba.get_team_info(dfs[3])
+    path = f'{team}_{season}_images'
+    nba.directory(path)
+    nba.web_scraping_nba_logos(name, path)
+    results['graphs'] = measure(lambda: nba.graphs(*dfs[:3], path, colors, name, team), repeat)
+
+    next_match_info = nba.predict_winner(name)
+    results['pdf'] = measure(lambda: nba.pdf(name, season, path, next_match_info), repeat)
+    jobs = nba.report_jobs(*dfs[:3], colors, name, team)
+    results['pdf_vector'] = measure(lambda: nba.pdf(name, season, path, next_match_info, save=False, jobs=jobs), repeat)
+
+    results['report'] = measure(lambda: nba.report(team, season, *nba.get_dfs(team, season)), repeat)
+    results['report_bytes'] = measure(lambda: nba.report_bytes(team, season, *nba.get_dfs(team, season)), repeat)
+    results['report_bytes_vector'] = measure(lambda: nba.report_bytes(team, season, *nba.get_dfs(team, season), vector=True), repeat)
+    results['batch'] = measure(lambda: nba.batch('all', season, workers=workers), 1)
+    results['batch_vector'] = measure(lambda: nba.batch('all', season, workers=workers, vector=True), 1)
+    results['batch_shared_vector'] = measure(lambda: nba.batch('all', season, workers=workers, vector=True, shared=True), 1)
+
+    sizes = {'png': len(nba.report_bytes(team, season, *dfs)), 'vector': len(nba.report_bytes(team, season, *dfs, vector=True))}
+    return (results, sizes)
+
+
+def version() -> str:
+    """Commit of the code being measured"""
+
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ''
+
+
+def compare(previous: dict, current: dict) -> None:
+    """Print the change of every timing with respect to a previous run"""
+
+    for stage, timing in current['results'].items():
+        if stage in previous['results']:
+            before = previous['results'][stage]['best']
+            change = (timing['best'] - before) / before * 100
+            print(f"{stage:>20}: {timing['best']:8.3f}s  ({change:+.1f}% vs {previous['version']})")
+        else:
+            print(f"{stage:>20}: {timing['best']:8.3f}s")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Offline benchmark of the NBA report')
+    parser.add_argument('--fixtures', help='cache directory with recorded responses (a synthetic league is generated if not given)')
+    parser.add_argument('--team', default='T00', help='team of the single-team timings')
+    parser.add_argument('--season', default='2022')
+    parser.add_argument('--teams', type=int, default=30, help='teams of the synthetic league')
+    parser.add_argument('--players', type=int, default=15, help='players per team of the synthetic league')
+    parser.add_argument('--games', type=int, default=82, help='games per team and season of the synthetic league')
+    parser.add_argument('--seasons', type=int, default=1, help='seasons of the synthetic league')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=None, help='processes of the batch (one per core by default)')
+    parser.add_argument('--output', default='bench_results.json', help='file the results are appended to')
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+    parameters = {key: value for key, value in vars(args).items() if key not in ('repeat', 'output')}
+
+    with tempfile.TemporaryDirectory() as work:
+        fixtures = os.path.abspath(args.fixtures) if args.fixtures else os.path.join(work, 'fixtures')
+        if not args.fixtures:
+            record_fixtures(synthetic_league(args.teams, args.players, args.games, args.seasons, int(args.season)), fixtures)
+
+        # The report writes its images and PDFs in the working directory
+        os.chdir(work)
+        with open('config.txt', 'w') as file:
+            file.write('API KEY = offline')
+        (results, sizes) = run(fixtures, args.team, args.season, args.repeat, args.workers)
+        current = {'version': version(), 'time': time.time(), 'parameters': parameters, 'results': results, 'pdf_bytes': sizes}
+
+    history = []
+    if os.path.exists(output):
+        with open(output, 'r') as file:
+            history = json.load(file)
+    previous = [entry for entry in history if entry['parameters'] == parameters]
+    if previous:
+        compare(previous[-1], current)
+    else:
+        compare({'results': {}}, current)
+    print(f"PDF size: {current['pdf_bytes']['png']} bytes with PNG charts, {current['pdf_bytes']['vector']} bytes with vector charts")
+
+    history.append(current)
+    with open(output, 'w') as file:
+        json.dump(history, file, indent=2)
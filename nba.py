@@ -1,11 +1,50 @@
+from __future__ import annotations
 import warnings
 import os
-import pandas as pd
-import matplotlib.pyplot as plt
-import numpy as np
-import requests
-from bs4 import BeautifulSoup
-from fpdf import FPDF
+import json
+import time
+import hashlib
+import math
+import argparse
+import importlib
+import threading
+import io
+import zlib
+import unicodedata
+import cProfile
+import resource
+import fcntl
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import TYPE_CHECKING
+
+# Charts are only rendered to PNG, so matplotlib never has to probe for a GUI backend
+os.environ['MPLBACKEND'] = 'Agg'
+
+
+class LazyModule:
+    """Module imported on first use, so each stage of the report only pays for the libraries it needs"""
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attribute: str):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attribute)
+
+
+if TYPE_CHECKING:
+    import pandas as pd
+    import numpy as np
+    import requests
+    from matplotlib.figure import Figure
+else:
+    pd = LazyModule('pandas')
+    np = LazyModule('numpy')
 
 warnings.filterwarnings('ignore')
 
@@ -13,48 +52,660 @@ warnings.filterwarnings('ignore')
 def directory(path: str) -> None:
     """Create a directory if it doesn't exist"""
 
-    if not os.path.exists(path):
-        os.mkdir(path)
-
-
-def extract_api(url: str, headers: dict) -> pd.DataFrame:
+    # exist_ok, as the cache directory may be created by several threads at once
+    os.makedirs(path, exist_ok=True)
+
+
+def write_file(file_name: str, content: bytes) -> None:
+    """Write a file atomically, so other threads and processes never read half of it"""
+
+    # We write to a temporary file of our own and then rename it over the file
+    tmp = f'{file_name}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp, 'wb') as file:
+        file.write(content)
+    os.replace(tmp, file_name)
+
+
+class RunRecord:
+    """Structured record of a report run: stages, requests and charts
+
+    Every stage saves its wall time, every request its HTTP status, the
+    bytes downloaded and the retries, and every chart its render time and
+    PNG size. The record is saved as JSON with the peak memory (RSS) of the
+    run.
+    """
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.stages = []
+        self.requests = []
+        self.charts = []
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str, **info):
+        """Time the code run inside the with block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.stages.append({'stage': name, **info, 'seconds': time.perf_counter() - start})
+
+    def request(self, url: str, status, size: int, retries: int, seconds: float) -> None:
+        """Save a request, with status 'cache' when it was served from disk"""
+        with self.lock:
+            self.requests.append({'url': url, 'status': status, 'bytes': size, 'retries': retries, 'seconds': seconds})
+
+    def chart(self, name: str, size: int, seconds: float) -> None:
+        """Save the render of a chart"""
+        with self.lock:
+            self.charts.append({'chart': name, 'bytes': size, 'seconds': seconds})
+
+    def merge(self, other: dict) -> None:
+        """Add the stages, requests and charts of a record made in another process (see to_dict)"""
+        with self.lock:
+            self.stages.extend(other['stages'])
+            self.requests.extend(other['requests'])
+            self.charts.extend(other['charts'])
+
+    def to_dict(self) -> dict:
+        # ru_maxrss is in kilobytes on Linux. The charts are rendered in child processes,
+        # whose peak is the largest of all the children
+        return {
+            'started_at': self.started_at,
+            'stages': self.stages,
+            'requests': self.requests,
+            'charts': self.charts,
+            'bytes_downloaded': sum(request['bytes'] for request in self.requests),
+            'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            'peak_rss_children_kb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+        }
+
+    def save(self, file_name: str) -> None:
+        with open(file_name, 'w') as file:
+            json.dump(self.to_dict(), file, indent=2)
+
+
+# Record of the current run
+record = RunRecord()
+
+
+# Time (in seconds) a cached response is considered fresh for each kind of request
+TTL = {
+    'teams': 7 * 24 * 3600,
+    'logos': 30 * 24 * 3600,
+    'players': 24 * 3600,
+    'player_stats': 6 * 3600,
+    'schedules': 3600,
+    'odds': 15 * 60,
+}
+
+
+# Pages scraped for the logos and the odds
+LOGOS_URL = "https://loodibee.com/nba/"
+ODDS_URL = 'https://www.sportytrader.es/cuotas/baloncesto/usa/nba-306/'
+
+# (connect, read) timeout in seconds of every request
+TIMEOUT = (5, 30)
+
+# File with the API key
+CONFIG_FILE = 'config.txt'
+
+
+def make_session(pool_size: int = 16, retries: int = 3) -> requests.Session:
+    """Create a session that reuses connections and retries failed requests with backoff"""
+
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=('GET',))
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+# Session shared by all the requests, so connections are kept alive between them.
+# It is created by the first request, as the stages that read from the cache never need it
+session = None
+session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """Return the shared session, creating it on first use"""
+
+    global session
+    with session_lock:
+        if session is None:
+            session = make_session()
+    return session
+
+
+class ResponseCache:
+    """On-disk cache of HTTP responses keyed by url and params
+
+    Fresh entries (younger than the given ttl) are served from disk. Stale
+    entries are revalidated with ETag / If-Modified-Since, so an unchanged
+    resource only costs a 304. The cache is bounded to max_size bytes,
+    evicting the least recently used entries first. In offline mode the
+    network is never used, which lets a fixtures directory stand in for the
+    API.
+    """
+
+    def __init__(self, path: str = '.nba_cache', max_size: int = 200 * 1024 ** 2, offline: bool = False):
+        self.path = path
+        self.max_size = max_size
+        self.offline = offline
+        self.lock = threading.Lock()
+
+    def key(self, url: str, params: dict = None) -> str:
+        """Name of the cache entry of a request"""
+        request = url + '?' + json.dumps(params or {}, sort_keys=True)
+        return hashlib.sha256(request.encode()).hexdigest()
+
+    def get(self, url: str, ttl: float, headers: dict = None, params: dict = None) -> bytes:
+        """Return the body of the response, from disk when possible"""
+
+        start = time.perf_counter()
+        key = self.key(url, params)
+        body_file = os.path.join(self.path, key + '.body')
+        meta_file = os.path.join(self.path, key + '.json')
+
+        meta = None
+        try:
+            with open(meta_file, 'r') as file:
+                meta = json.load(file)
+            if self.offline or time.time() - meta['fetched_at'] < ttl:
+                body = self._read(body_file)
+                record.request(url, 'cache', 0, 0, time.perf_counter() - start)
+                return body
+            if not os.path.exists(body_file):
+                meta = None
+        except FileNotFoundError:
+            # The entry is not cached, or another process evicted it meanwhile
+            meta = None
+
+        if self.offline:
+            raise LookupError(f'{url} is not cached and the cache is offline')
+
+        headers = dict(headers or {})
+        if meta is not None:
+            # We ask the server to send the body only if it has changed
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+
+        response = get_session().get(url=url, headers=headers, params=params, timeout=TIMEOUT)
+        retries = getattr(response.raw, 'retries', None)
+        record.request(url, response.status_code, len(response.content),
+                       len(retries.history) if retries is not None else 0, time.perf_counter() - start)
+        if response.status_code == 304 and meta is not None:
+            try:
+                body = self._read(body_file)
+            except FileNotFoundError:
+                # The body was evicted by another process since we checked it, so we download it again
+                return self.get(url, 0, {name: value for (name, value) in headers.items()
+                                         if name not in ('If-None-Match', 'If-Modified-Since')}, params)
+            meta['fetched_at'] = time.time()
+            self._write(meta_file, json.dumps(meta).encode())
+            return body
+        response.raise_for_status()
+
+        meta = {
+            'url': url,
+            'params': params,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'fetched_at': time.time(),
+        }
+        directory(self.path)
+        self._write(body_file, response.content)
+        self._write(meta_file, json.dumps(meta).encode())
+        self.evict()
+        return response.content
+
+    def fetched_at(self, url: str, params: dict = None) -> float:
+        """Time the cached response of a request was downloaded or last revalidated (None if it is not cached)"""
+
+        try:
+            with open(os.path.join(self.path, self.key(url, params) + '.json'), 'r') as file:
+                return json.load(file)['fetched_at']
+        except FileNotFoundError:
+            return None
+
+    def put(self, url: str, body: bytes, params: dict = None) -> None:
+        """Save a response body as if it had just been downloaded, e.g. to record fixtures"""
+
+        key = self.key(url, params)
+        meta = {'url': url, 'params': params, 'etag': None, 'last_modified': None, 'fetched_at': time.time()}
+        directory(self.path)
+        self._write(os.path.join(self.path, key + '.body'), body)
+        self._write(os.path.join(self.path, key + '.json'), json.dumps(meta).encode())
+
+    def _read(self, body_file: str) -> bytes:
+        # The modification time of the body tracks its last use for the LRU eviction
+        os.utime(body_file)
+        with open(body_file, 'rb') as file:
+            return file.read()
+
+    def _write(self, file_name: str, content: bytes) -> None:
+        write_file(file_name, content)
+
+    def evict(self) -> None:
+        """Remove the least recently used entries until the cache fits in max_size"""
+
+        # The lock only covers the threads of this process: other processes sharing the cache may
+        # evict the same entries at the same time, so the files that are already gone are skipped
+        with self.lock:
+            bodies = []
+            for entry in os.scandir(self.path):
+                if entry.name.endswith('.body'):
+                    try:
+                        bodies.append((entry.stat().st_mtime, entry.stat().st_size, entry.path))
+                    except FileNotFoundError:
+                        continue
+            bodies.sort()
+            size = sum(entry_size for (_, entry_size, _) in bodies)
+            for (_, entry_size, body_file) in bodies:
+                if size <= self.max_size:
+                    break
+                size -= entry_size
+                for file_name in (body_file, body_file[:-len('.body')] + '.json'):
+                    try:
+                        os.remove(file_name)
+                    except FileNotFoundError:
+                        pass
+
+
+# Cache used by all the requests. Replace it with ResponseCache('fixtures', offline=True)
+# to run the report from recorded responses only
+cache = ResponseCache()
+
+
+def fetch(url: str, ttl: float, headers: dict = None) -> bytes:
+    """Get the body of the response of the given url through the cache"""
+    return cache.get(url, ttl, headers=headers)
+
+
+def extract_api(url: str, headers: dict, ttl: float) -> pd.DataFrame:
     """Extract data from API with given url and headers"""
-    return pd.DataFrame(requests.get(url=url, headers=headers).json())
+    return pd.DataFrame(json.loads(fetch(url, ttl, headers)))
 
 
-def get_dfs(team: str, season: str) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame]:
-    """Get all the dataframes needed for the report"""
+def get_headers() -> dict:
+    """Read the API key from the config file and build the request headers"""
 
     # Read the API key from the config file
-    file = open("config.txt", "r")
+    file = open(CONFIG_FILE, "r")
     # Read the file
     API_KEY = file.read()[10:]
     # Close the file
     file.close()
 
-    headers = {'Ocp-Apim-Subscription-Key': API_KEY}
+    return {'Ocp-Apim-Subscription-Key': API_KEY}
 
-    url_players = f"https://api.sportsdata.io/v3/nba/scores/json/Players/{team}"
-    df_players = extract_api(url_players, headers)
 
-    url_schedules = "https://api.sportsdata.io/v3/nba/scores/json/Games/2022"
-    df_schedules = extract_api(url_schedules, headers)
-    df_schedules = df_schedules[(df_schedules['AwayTeam'] == team) | (df_schedules['HomeTeam'] == team)]
-    df_schedules['Winner'] = df_schedules.apply(lambda x: x['AwayTeam'] if x['AwayTeamScore'] > x['HomeTeamScore'] else x['HomeTeam'], axis=1)
+def filter_schedules(df_schedules: pd.DataFrame, team: str) -> pd.DataFrame:
+    """Keep only the games of the given team and add the 'Winner' column"""
+
+    df_schedules = df_schedules[(df_schedules['AwayTeam'] == team) | (df_schedules['HomeTeam'] == team)].copy()
+    df_schedules['Winner'] = np.where(df_schedules['AwayTeamScore'] > df_schedules['HomeTeamScore'], df_schedules['AwayTeam'], df_schedules['HomeTeam'])
     df_schedules.reset_index(inplace=True)
+    return df_schedules
 
-    url_player_stats = f"https://api.sportsdata.io/v3/nba/stats/json/PlayerSeasonStatsByTeam/{season}/{team}"
-    df_player_stats = extract_api(url_player_stats, headers)
 
-    url_teams = "https://api.sportsdata.io/v3/nba/scores/json/teams"
-    df_team = extract_api(url_teams, headers)
-    df_team = df_team[df_team['Key'] == team]  # We filter the df to get only the demanded team
+def filter_team(df_teams: pd.DataFrame, team: str) -> pd.DataFrame:
+    """Keep only the row of the given team and add the 'TeamName' column"""
+
+    df_team = df_teams[df_teams['Key'] == team].copy()  # We filter the df to get only the demanded team
     df_team['TeamName'] = df_team['City'] + ' ' + df_team['Name']  # We create a new column with the team name
     df_team.reset_index(inplace=True)
+    return df_team
+
+
+# Directory of the local copy of the schedules
+GAMES_STORE = 'games_store'
+
+# SeasonType of the games of a season, by the suffix of the season ('2023' is the regular season)
+SEASON_TYPES = {'REG': 1, 'PRE': 2, 'POST': 3}
+
+
+def sync_schedule(season: str, headers: dict, full: bool = False, store: str = GAMES_STORE, sync: bool = True) -> pd.DataFrame:
+    """Schedule of a season, kept in a local game store keyed by GameID
+
+    The first time (or with full=True, or after a long break) the whole season
+    is downloaded. Otherwise only the games of the days since the last sync
+    are requested, by date, and upserted into the store. GamesByDate returns
+    the games of every season type, so only those of the season's type are
+    kept, as in the full download. With sync=False the store is read as it
+    is, without requesting nor saving anything.
+    """
+
+    store_file = os.path.join(store, f'games_{season}.json')
+    games = {}
+    synced_at = None
+    if not full and os.path.exists(store_file):
+        with open(store_file, 'r') as file:
+            saved = json.load(file)
+        games = saved['games']
+        synced_at = datetime.fromtimestamp(saved['synced_at'])
+
+    if games and not sync:
+        return pd.DataFrame(list(games.values()))
+
+    now = datetime.now()
+    if games and all(game.get('Status') in ('Final', 'F/OT', 'Canceled') for game in games.values()):
+        # The season is over, there is nothing left to sync
+        return pd.DataFrame(list(games.values()))
+    if synced_at is None or now - synced_at > timedelta(days=30):
+        url_schedules = f"https://api.sportsdata.io/v3/nba/scores/json/Games/{season}"
+        games = {str(game['GameID']): game for game in json.loads(fetch(url_schedules, TTL['schedules'], headers))}
+    else:
+        # We start the day before the last sync, so the games that were in progress are updated
+        day = synced_at.date() - timedelta(days=1)
+        season_type = SEASON_TYPES[season[4:] or 'REG']
+        while day <= now.date():
+            url_games = f"https://api.sportsdata.io/v3/nba/scores/json/GamesByDate/{day.strftime('%Y-%b-%d').upper()}"
+            for game in json.loads(fetch(url_games, TTL['schedules'], headers)):
+                if str(game.get('Season')) == season[:4] and game.get('SeasonType') == season_type:
+                    games[str(game['GameID'])] = game
+            day += timedelta(days=1)
+
+    directory(store)
+    write_file(store_file, json.dumps({'synced_at': now.timestamp(), 'games': games}).encode())
+
+    return pd.DataFrame(list(games.values()))
+
+
+def prefetch_pages(executor: ThreadPoolExecutor) -> None:
+    """Load the logo index and download the odds board in the background
+
+    The odds scraper later reads the board from the cache. Errors are ignored
+    here, as the logos and the scraper repeat the request and report them.
+    """
+    executor.submit(logo_index.load)
+    executor.submit(fetch, ODDS_URL, TTL['odds'])
+
+
+def get_dfs(team: str, season: str, full_schedule: bool = False, sync: bool = True) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """Get all the dataframes needed for the report
+
+    The schedule is synced incrementally unless full_schedule is True, and
+    read from the game store as it is with sync=False.
+    """
+
+    headers = get_headers()
+
+    url_players = f"https://api.sportsdata.io/v3/nba/scores/json/Players/{team}"
+    url_player_stats = f"https://api.sportsdata.io/v3/nba/stats/json/PlayerSeasonStatsByTeam/{season}/{team}"
+    url_teams = "https://api.sportsdata.io/v3/nba/scores/json/teams"
+
+    # All the requests are independent, so we send them at the same time
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        players = executor.submit(extract_api, url_players, headers, TTL['players'])
+        schedules = executor.submit(sync_schedule, season, headers, full_schedule, sync=sync)
+        player_stats = executor.submit(extract_api, url_player_stats, headers, TTL['player_stats'])
+        teams = executor.submit(extract_api, url_teams, headers, TTL['teams'])
+        prefetch_pages(executor)
+
+    df_players = players.result()
+    df_schedules = filter_schedules(schedules.result(), team)
+    df_player_stats = player_stats.result()
+    df_team = filter_team(teams.result(), team)
 
     return (df_players, df_schedules, df_player_stats, df_team)
 
 
+def get_league_dfs(season: str, full_schedule: bool = False) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """Get the league-wide dataframes, downloading each endpoint only once
+
+    The schedule is synced incrementally unless full_schedule is True.
+    """
+
+    headers = get_headers()
+
+    url_players = "https://api.sportsdata.io/v3/nba/scores/json/Players"
+    url_teams = "https://api.sportsdata.io/v3/nba/scores/json/teams"
+
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        players = executor.submit(extract_api, url_players, headers, TTL['players'])
+        schedules = executor.submit(sync_schedule, season, headers, full_schedule)
+        teams = executor.submit(extract_api, url_teams, headers, TTL['teams'])
+        prefetch_pages(executor)
+
+        # The player stats need the teams, and are downloaded while the rest finishes
+        df_player_stats = extract_league_player_stats(season, headers, teams.result()['Key'])
+
+    return (players.result(), schedules.result(), df_player_stats, teams.result())
+
+
+def extract_league_player_stats(season: str, headers: dict, teams: list) -> pd.DataFrame:
+    """Get the player stats of every team, as get_dfs gets those of one team
+
+    The league-wide PlayerSeasonStats has the full-season totals of a traded
+    player under his last team only, while PlayerSeasonStatsByTeam lists what
+    he did with each of his teams. So we download the latter for every team
+    and file each row under the team it was listed by.
+    """
+
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        player_stats = {team: executor.submit(extract_api, f"https://api.sportsdata.io/v3/nba/stats/json/PlayerSeasonStatsByTeam/{season}/{team}",
+                                              headers, TTL['player_stats'])
+                        for team in teams}
+    return pd.concat([stats.result().assign(Team=team) for (team, stats) in player_stats.items()], ignore_index=True)
+
+
+def split_league_dfs(team: str, df_players: pd.DataFrame, df_schedules: pd.DataFrame, df_player_stats: pd.DataFrame,
+                     df_teams: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """Split the league-wide dataframes into the same dataframes get_dfs returns for one team"""
+
+    df_team_players = df_players[df_players['Team'] == team].reset_index(drop=True)
+    df_team_player_stats = df_player_stats[df_player_stats['Team'] == team].reset_index(drop=True)
+
+    return (df_team_players, filter_schedules(df_schedules, team), df_team_player_stats, filter_team(df_teams, team))
+
+
+# Compact type of each column kept in the player stats store: counts as
+# integers, rates as float32 and repeated strings as categories
+STATS_DTYPES = {
+    'PlayerID': 'int32',
+    'Season': 'int16',
+    'Team': 'category',
+    'Name': 'category',
+    'Position': 'category',
+    'Games': 'int16',
+    'Minutes': 'int32',
+    'Points': 'int32',
+    'TwoPointersMade': 'int16',
+    'TwoPointersAttempted': 'int16',
+    'ThreePointersMade': 'int16',
+    'ThreePointersAttempted': 'int16',
+    'FreeThrowsPercentage': 'float32',
+    'Steals': 'int16',
+    'BlockedShots': 'int16',
+}
+
+# Directory of the player stats store
+STATS_STORE = 'stats_store'
+
+
+def compact_player_stats(df_player_stats: pd.DataFrame) -> pd.DataFrame:
+    """Copy of the player stats with only the store columns, cast to their compact types"""
+
+    columns = [column for column in STATS_DTYPES if column in df_player_stats.columns]
+    df_compact = df_player_stats[columns].copy()
+    for column in columns:
+        dtype = STATS_DTYPES[column]
+        if dtype.startswith('int'):
+            # Counts come from the JSON as floats, we truncate them as astype(int) did
+            df_compact[column] = df_compact[column].fillna(0).astype(dtype)
+        else:
+            df_compact[column] = df_compact[column].astype(dtype)
+    return df_compact
+
+
+def save_player_stats(df_player_stats: pd.DataFrame, season: str, store: str = STATS_STORE) -> None:
+    """Save the player stats of a season in the store, one directory of column arrays per team
+
+    Each column is a .npy file with its compact type. Category columns are
+    saved as their codes, with the categories in columns.json.
+    """
+
+    df_compact = compact_player_stats(df_player_stats)
+    for team, df_team_stats in df_compact.groupby('Team', observed=True):
+        team_path = os.path.join(store, season, team)
+        directory(team_path)
+        categories = {}
+        for column in df_team_stats.columns:
+            values = df_team_stats[column]
+            if STATS_DTYPES[column] == 'category':
+                values = values.cat.remove_unused_categories()
+                categories[column] = values.cat.categories.tolist()
+                values = values.cat.codes.astype('int16')
+            np.save(os.path.join(team_path, f'{column}.npy'), values.to_numpy())
+        with open(os.path.join(team_path, 'columns.json'), 'w') as file:
+            json.dump({'columns': list(df_team_stats.columns), 'categories': categories}, file)
+
+
+def load_player_stats(team: str, season: str, store: str = STATS_STORE) -> pd.DataFrame:
+    """Load the player stats of a team and season from the store, without parsing any JSON payload"""
+
+    team_path = os.path.join(store, season, team)
+    with open(os.path.join(team_path, 'columns.json'), 'r') as file:
+        schema = json.load(file)
+
+    data = {}
+    for column in schema['columns']:
+        # The arrays are memory-mapped, so each column is copied straight from the file into the
+        # dataframe, which holds all of it in memory, without reading it into a buffer first
+        values = np.load(os.path.join(team_path, f'{column}.npy'), mmap_mode='r')
+        if column in schema['categories']:
+            values = pd.Categorical.from_codes(values, schema['categories'][column])
+        data[column] = values
+    return pd.DataFrame(data)
+
+
+class SharedLeague:
+    """League-wide tables in one shared memory segment, as typed column arrays sorted by team
+
+    The parent process creates the segment once from the league dataframes.
+    The workers attach to it with its layout (a small dict of names, types and
+    offsets that is cheap to pickle) and read the rows of a team through views
+    of the shared arrays, so they only copy the rows of their team instead of
+    receiving their own pickled copy of every table. Text columns are stored
+    as category codes and the player stats with their compact STATS_DTYPES
+    types.
+    """
+
+    def __init__(self, memory: shared_memory.SharedMemory, layout: dict):
+        self.memory = memory
+        self.layout = layout
+
+    @classmethod
+    def create(cls, df_players: pd.DataFrame, df_schedules: pd.DataFrame, df_player_stats: pd.DataFrame,
+               df_teams: pd.DataFrame) -> SharedLeague:
+        """Copy the league dataframes (as get_league_dfs returns them) into a new shared memory segment"""
+
+        # Every game is a row of the schedule of both of its teams
+        n_games = len(df_schedules)
+        tables = {
+            'players': (df_players, df_players['Team'].to_numpy(), np.arange(len(df_players))),
+            'schedules': (df_schedules, np.concatenate([df_schedules['AwayTeam'].to_numpy(), df_schedules['HomeTeam'].to_numpy()]),
+                          np.concatenate([np.arange(n_games), np.arange(n_games)])),
+            'player_stats': (compact_player_stats(df_player_stats), df_player_stats['Team'].to_numpy(), np.arange(len(df_player_stats))),
+            'teams': (df_teams, df_teams['Key'].to_numpy(), np.arange(len(df_teams))),
+        }
+
+        arrays = []
+        layout = {'tables': {}}
+        size = 0
+        for (table, (df, keys, rows)) in tables.items():
+            # We sort the rows by team, keeping their order within each team
+            keys = keys.astype(str)
+            order = np.lexsort((rows, keys))
+            (teams, starts, counts) = np.unique(keys[order], return_index=True, return_counts=True)
+            spec = {'rows': len(order), 'columns': [],
+                    'teams': {team: (int(start), int(start + count)) for (team, start, count) in zip(teams, starts, counts)}}
+            for column in df.columns:
+                values = df[column]
+                categories = None
+                if not (pd.api.types.is_numeric_dtype(values) or pd.api.types.is_bool_dtype(values)):
+                    try:
+                        values = values.astype('category')
+                    except TypeError:
+                        # Nested values (lists or dicts) are not hashable, so we keep their text
+                        values = values.astype(str).astype('category')
+                    categories = values.cat.categories.tolist()
+                    values = values.cat.codes
+                values = values.to_numpy()[rows[order]]
+                spec['columns'].append((column, values.dtype.str, size, categories))
+                arrays.append((size, values))
+                # The next array starts aligned to 8 bytes
+                size += -(-values.nbytes // 8) * 8
+            layout['tables'][table] = spec
+
+        memory = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        layout['name'] = memory.name
+        for (offset, values) in arrays:
+            np.ndarray(values.shape, dtype=values.dtype, buffer=memory.buf, offset=offset)[:] = values
+        return cls(memory, layout)
+
+    @classmethod
+    def attach(cls, layout: dict) -> SharedLeague:
+        """Attach to the segment created by another process"""
+        return cls(shared_memory.SharedMemory(name=layout['name']), layout)
+
+    def table(self, table: str, team: str) -> pd.DataFrame:
+        """Rows of a team in one of the tables, built from views of the shared arrays
+
+        The player stats keep their category columns, as in the stats store;
+        the text of the other tables is decoded back to strings, and the
+        missing values to None as in the dataframes of the JSON.
+        """
+
+        spec = self.layout['tables'][table]
+        (start, stop) = spec['teams'].get(team, (0, 0))
+        data = {}
+        for (column, dtype, offset, categories) in spec['columns']:
+            values = np.ndarray(spec['rows'], dtype=dtype, buffer=self.memory.buf, offset=offset)[start:stop]
+            if categories is not None and table == 'player_stats':
+                values = pd.Categorical.from_codes(values, categories)
+            elif categories is not None:
+                # The code of a missing value is -1, which picks the None at the end
+                values = np.array(categories + [None], dtype=object)[values]
+            data[column] = values
+        return pd.DataFrame(data, columns=[column for (column, _, _, _) in spec['columns']])
+
+    def team_dfs(self, team: str) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+        """The same dataframes get_dfs returns for one team"""
+
+        return (self.table('players', team), filter_schedules(self.table('schedules', team), team),
+                self.table('player_stats', team), filter_team(self.table('teams', team), team))
+
+    def close(self, unlink: bool = False) -> None:
+        """Detach from the segment, and free it with unlink=True (only the process that created it)"""
+
+        self.memory.close()
+        if unlink:
+            self.memory.unlink()
+
+
+# League tables attached by this worker process, see attach_shared_league
+shared_league = None
+
+
+def attach_shared_league(layout: dict) -> None:
+    """Attach a worker process to the shared league tables once, when it starts"""
+
+    global shared_league
+    shared_league = SharedLeague.attach(layout)
+
+
 def get_team_info(df_team: pd.DataFrame) -> tuple[list, str]:
     """Get team colors and name"""
 
@@ -65,362 +716,1129 @@ def get_team_info(df_team: pd.DataFrame) -> tuple[list, str]:
     return (colors, name)
 
 
-def graphs(df_players: pd.DataFrame, df_schedules: pd.DataFrame, df_player_stats: pd.DataFrame, path: str, colors: list, name: str) -> None:
-    """Create all the graphs for the report using the obtained dataframes"""
+def figure(**kwargs) -> Figure:
+    """Create a figure, importing matplotlib only once a chart is rendered"""
 
-    # 1.1 Table of Players
-    df_table_players = df_players[['Position', 'Height', 'Weight', 'BirthDate', 'BirthCountry', 'College', 'Salary']]  # 'PhotoUrl'
-    df_table_players.loc[:, 'BirthDate'] = [df_table_players.loc[i, 'BirthDate'][:10] for i in range(len(df_table_players['BirthDate']))]
-    # We convert the height from feet to cm
-    df_table_players.loc[:, 'Height'] = [str(round(df_table_players.loc[i, 'Height']*2.54, 1))+' cm' for i in range(len(df_table_players['Height']))]
-    player_names = [df_players.loc[i, 'FirstName'] + ' ' + df_players.loc[i, 'LastName'] for i in range(len(df_players['FirstName']))]
+    from matplotlib.figure import Figure
+    return Figure(**kwargs)
+
+
+def render(fig: Figure, **kwargs) -> bytes:
+    """Render a figure to PNG with the Agg backend"""
 
-    fig, ax = plt.subplots(figsize=(20, 10))
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    FigureCanvasAgg(fig)
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png', **kwargs)
+    return buffer.getvalue()
+
+
+def chart_table(cells: tuple, columns: tuple, rows: tuple, color: str) -> bytes:
+    """Table with the general information of the players"""
+
+    fig = figure(figsize=(20, 10))
+    ax = fig.add_subplot()
     ax.axis('tight')
     ax.axis('off')
-    plt.table(cellText=df_table_players.values, colLabels=df_table_players.columns, loc='center',
-              cellLoc='center', colLoc='center', bbox=[0, 0, 1, 1], rowLabels=player_names,
-              rowColours=[colors[0]] * len(df_table_players), colColours=[colors[0]] * len(df_table_players.columns))
-    # plt.show()
-    fig.savefig(f'{path}/table_players.png')
-    plt.close()
+    ax.table(cellText=cells, colLabels=columns, loc='center',
+             cellLoc='center', colLoc='center', bbox=[0, 0, 1, 1], rowLabels=rows,
+             rowColours=[color] * len(cells), colColours=[color] * len(columns))
+    return render(fig)
 
 
-    # 1.2 Pyplot PieChart on Win Rate
-    win_rate = len(df_schedules[df_schedules['Winner'] == team]) / len(df_schedules)
+def chart_pie(win_rate: float, title: str) -> bytes:
+    """PieChart on a win rate"""
 
     labels = ['Win', 'Lose']
     sizes = [win_rate, 1 - win_rate]
     explode = (0.1, 0)
-    fig, ax = plt.subplots()
-    ax.pie(sizes, explode=explode, labels=labels, autopct='%1.1f%%', shadow=True, startangle=90, colors=['green', 'red'])
-    ax.axis('equal')
-    plt.title(f'Win Rate - {name}')
-    # plt.show()
-    fig.savefig(f'{path}/win_rate.png', bbox_inches='tight')
-    plt.close()
+    fig = figure()
+    ax = fig.add_subplot()
+    if math.isnan(win_rate):
+        # No games yet (e.g. no home game early in the season)
+        ax.text(0.5, 0.5, 'No games', ha='center', va='center')
+        ax.axis('off')
+    else:
+        ax.pie(sizes, explode=explode, labels=labels, autopct='%1.1f%%', shadow=True, startangle=90, colors=['green', 'red'])
+        ax.axis('equal')
+    ax.set_title(title)
+    return render(fig, bbox_inches='tight')
 
 
-    # 1.3 Pyplot PieChart on Win Rate Home
-    win_rate_home = len(df_schedules[(df_schedules['Winner'] == team) & (df_schedules['HomeTeam'] == team)]) / len(df_schedules[df_schedules['HomeTeam'] == team])
+def chart_bar(names: tuple, values: tuple, color: str, title: str, ylabel: str) -> bytes:
+    """Barplot of one statistic per player"""
 
-    labels = ['Win', 'Lose']
-    sizes = [win_rate_home, 1 - win_rate_home]
-    explode = (0.1, 0)
-    fig, ax = plt.subplots()
-    ax.pie(sizes, explode=explode, labels=labels, autopct='%1.1f%%', shadow=True, startangle=90, colors=['green', 'red'])
-    ax.axis('equal')
-    plt.title(f'Win Rate Home - {name}')
-    # plt.show()
-    fig.savefig(f'{path}/win_rate_home.png', bbox_inches='tight')
-    plt.close()
+    fig = figure(figsize=(10, 5))
+    ax = fig.add_subplot()
+    ax.bar(names, values, color=color)
+    ax.set_title(title)
+    ax.set_xlabel('Player')
+    ax.set_ylabel(ylabel)
+    ax.tick_params(axis='x', labelrotation=70)
+    return render(fig, bbox_inches='tight')
 
 
-    # 1.4 Pyplot PieChart on Win Rate Away
-    win_rate_away = len(df_schedules[(df_schedules['Winner'] == team) & (df_schedules['AwayTeam'] == team)]) / len(df_schedules[df_schedules['AwayTeam'] == team])
+def chart_grouped_bar(names: tuple, two_pointers: tuple, three_pointers: tuple, colors: tuple, title: str, ylabel: str) -> bytes:
+    """Grouped barplot of two and three pointers per player"""
 
-    labels = ['Win', 'Lose']
-    sizes = [win_rate_away, 1 - win_rate_away]
-    explode = (0.1, 0)
-    fig, ax = plt.subplots()
-    ax.pie(sizes, explode=explode, labels=labels, autopct='%1.1f%%', shadow=True, startangle=90, colors=['green', 'red'])
-    ax.axis('equal')
-    plt.title(f'Win Rate Away - {name}')
-    # plt.show()
-    fig.savefig(f'{path}/win_rate_away.png', bbox_inches='tight')
-    plt.close()
+    x = np.arange(len(names))
+    width = 0.35
 
+    fig = figure(figsize=(10, 5))
+    ax = fig.add_subplot()
+    ax.bar(x - width/2, two_pointers, width, label='Two Pointers', color=colors[0], edgecolor='black')
+    ax.bar(x + width/2, three_pointers, width, label='Three Pointers', color=colors[1], edgecolor='black')
 
-    # 2.1 Season Points
-    df_player_stats['Points'] = df_player_stats['Points'].astype(int)
-    df_player_stats.sort_values(by='Points', ascending=False, inplace=True)
+    ax.set_ylabel(ylabel)
+    ax.set_title(title)
+    ax.set_xticks(x, labels=names, rotation=70)
+    ax.legend()
+    fig.tight_layout()
+    return render(fig, bbox_inches='tight')
 
-    fig = plt.figure(figsize=(10, 5))
-    plt.bar(df_player_stats['Name'], df_player_stats['Points'], color=colors[0])
-    plt.title('Points')
-    plt.xlabel('Player')
-    plt.ylabel('Points')
-    plt.xticks(rotation=70)
-    # plt.show()
-    fig.savefig(f'{path}/points.png', bbox_inches='tight')
-    plt.close()
 
+def chart_free_throws(names: tuple, percentages: tuple, color: str) -> bytes:
+    """Horizontal barplot on free throw percentage"""
 
-    # 2.2 Points per minute
-    df_player_stats['PointsPerMinute'] = df_player_stats['Points'] / df_player_stats['Minutes']
-    df_player_stats.sort_values(by='PointsPerMinute', ascending=False, inplace=True)
+    fig = figure(figsize=(10, 5))
+    ax = fig.add_subplot()
+    ax.barh(names, percentages, color=color)
+    ax.set_xlabel('Player')
+    ax.set_ylabel('Free Throw Percentage')
+    ax.set_title('Free Throw Percentage')
+    ax.set_xlim(right=100)
+    return render(fig, bbox_inches='tight')
 
-    fig = plt.figure(figsize=(10, 5))
-    plt.bar(df_player_stats['Name'], df_player_stats['PointsPerMinute'], color=colors[1])
-    plt.xlabel('Player')
-    plt.ylabel('Points Per Minute')
-    plt.title('Points Per Minute')
-    plt.xticks(rotation=70)
-    # plt.show()
-    fig.savefig(f'{path}/points_per_minute.png', bbox_inches='tight')
-    plt.close()
 
+def chart_defense(names: tuple, steals: tuple, blocked_shots: tuple, colors: tuple, title: str) -> bytes:
+    """Stacked barplot of steals and blocked shots per player"""
 
-    # 3.1 Grouped barplot on Shot Accuracy
-    df_player_stats['TwoPointerAccuracy'] = df_player_stats['TwoPointersMade'] / df_player_stats['TwoPointersAttempted']
-    df_player_stats['ThreePointerAccuracy'] = df_player_stats['ThreePointersMade'] / df_player_stats['ThreePointersAttempted']
-    df_player_stats.sort_values(by='TwoPointerAccuracy', ascending=False, inplace=True)
+    fig = figure(figsize=(10, 5))
+    ax = fig.add_subplot()
+    ax.bar(names, steals, color=colors[0], edgecolor='black')
+    ax.bar(names, blocked_shots, bottom=steals, color=colors[1], edgecolor='black')
+    ax.set_xlabel('Player')
+    ax.set_ylabel('Defensive Statistics')
+    ax.set_title(title)
+    ax.legend(['Steals', 'Blocked Shots'])
+    ax.tick_params(axis='x', labelrotation=70)
+    return render(fig, bbox_inches='tight')
 
-    x = np.arange(len(df_player_stats['Name']))
-    width = 0.35
 
-    fig, ax = plt.subplots(1, 1, figsize=(10, 5))
-    rects1 = ax.bar(x - width/2, df_player_stats['TwoPointerAccuracy'], width, label='Two Pointers', color=colors[0], edgecolor='black')
-    rects2 = ax.bar(x + width/2, df_player_stats['ThreePointerAccuracy'], width, label='Three Pointers', color=colors[1], edgecolor='black')
+def chart_shots(names: tuple, attempted: tuple, made: tuple, title: str) -> bytes:
+    """Overlapped barplot of shots attempted and made per player"""
 
-    ax.set_ylabel('Percentage')
-    ax.set_title('Shot Accuracy')
-    ax.set_xticks(x, labels=df_player_stats['Name'], rotation=70)
-    ax.legend()
-    fig.tight_layout()
-    # plt.show()
-    fig.savefig(f'{path}/shot_accuracy.png', bbox_inches='tight')
-    plt.close()
+    fig = figure(figsize=(10, 5))
+    ax = fig.add_subplot()
+    ax.set_title(title)
+    ax.bar(names, attempted, color='red')
+    ax.bar(names, made, color='green')
+    ax.legend(['Missed', 'Scored'])
+    ax.set_xlabel('Player')
+    ax.set_ylabel(title)
+    ax.tick_params(axis='x', labelrotation=70)
+    return render(fig, bbox_inches='tight')
 
 
-    # 3.2 Grouped barplot on Shots Scored
-    df_player_stats.sort_values(by='TwoPointersMade', ascending=False, inplace=True)
+def compute_team_metrics(df_schedules: pd.DataFrame, team: str) -> dict:
+    """Wins and losses of a team, in total, at home and away, from its schedule
 
-    x = np.arange(len(df_player_stats['Name']))
-    width = 0.35
+    The games are counted in one grouped pass over the schedule, by whether
+    the team played at home and whether it won. The win rate of a bucket
+    without games (e.g. no home game yet) is nan.
+    """
 
-    fig, ax = plt.subplots(1, 1, figsize=(10, 5))
-    rects1 = ax.bar(x - width/2, df_player_stats['TwoPointersMade'], width, label='Two Pointers', color=colors[0], edgecolor='black')
-    rects2 = ax.bar(x + width/2, df_player_stats['ThreePointersMade'], width, label='Three Pointers', color=colors[1], edgecolor='black')
+    home = (df_schedules['HomeTeam'] == team).rename('Home')
+    won = (df_schedules['Winner'] == team).rename('Won')
+    counts = won.groupby([home, won]).size()
 
-    ax.set_ylabel('Scored')
-    ax.set_title('Shots Scored')
-    ax.set_xticks(x, labels=df_player_stats['Name'], rotation=70)
-    ax.legend()
-    fig.tight_layout()
-    # plt.show()
-    fig.savefig(f'{path}/shots_made.png', bbox_inches='tight')
-    plt.close()
+    home_wins = int(counts.get((True, True), 0))
+    home_losses = int(counts.get((True, False), 0))
+    away_wins = int(counts.get((False, True), 0))
+    away_losses = int(counts.get((False, False), 0))
+    wins = home_wins + away_wins
+    losses = home_losses + away_losses
 
+    def rate(won, lost):
+        return won / (won + lost) if won + lost else math.nan
 
-    # 3.3 Barplot on free throw percentage
-    free_throws = df_player_stats[['Name', 'FreeThrowsPercentage']]
-    free_throws = free_throws[free_throws['FreeThrowsPercentage'] > 0]
-    free_throws.sort_values(by='FreeThrowsPercentage', ascending=False, inplace=True)
+    return {
+        'wins': wins,
+        'losses': losses,
+        'home_wins': home_wins,
+        'home_losses': home_losses,
+        'away_wins': away_wins,
+        'away_losses': away_losses,
+        'win_rate': rate(wins, losses),
+        'win_rate_home': rate(home_wins, home_losses),
+        'win_rate_away': rate(away_wins, away_losses),
+    }
 
-    fig, ax = plt.subplots(1, 1, figsize=(10, 5))
-    plt.barh(free_throws['Name'], free_throws['FreeThrowsPercentage'], color=colors[0])
-    plt.xlabel('Player')
-    plt.ylabel('Free Throw Percentage')
-    plt.title('Free Throw Percentage')
-    plt.xlim(right=100)
-    # plt.show()
-    fig.savefig(f'{path}/free_throw_percentage.png', bbox_inches='tight')
-    plt.close()
 
+# Metrics the players are ranked by (from highest to lowest) in the charts
+RANKED_METRICS = ('Points', 'PointsPerMinute', 'TwoPointerAccuracy', 'TwoPointersMade', 'FreeThrowsPercentage',
+                  'Defense', 'DefensePerMinute', 'TwoPointersAttempted', 'ThreePointersAttempted')
 
-    # 4.1 Defense statistics
-    df_player_stats['Steals'] = df_player_stats['Steals'].astype(int)
-    df_player_stats['BlockedShots'] = df_player_stats['BlockedShots'].astype(int)
-    df_player_stats['Defense'] = df_player_stats['Steals'] + df_player_stats['BlockedShots']
-    df_player_stats.sort_values(by='Defense', ascending=False, inplace=True)
-
-    fig = plt.figure(figsize=(10, 5))
-    plt.bar(df_player_stats['Name'], df_player_stats['Steals'], color=colors[0], edgecolor='black')
-    plt.bar(df_player_stats['Name'], df_player_stats['BlockedShots'], bottom=df_player_stats['Steals'], color=colors[1], edgecolor='black')
-    plt.xlabel('Player')
-    plt.ylabel('Defensive Statistics')
-    plt.title('Defensive Statistics')
-    plt.legend(['Steals', 'Blocked Shots'])
-    plt.xticks(rotation=70)
-    # plt.show()
-    fig.savefig(f'{path}/defense.png', bbox_inches='tight')
-    plt.close()
 
+def player_metrics(df_player_stats: pd.DataFrame) -> pd.DataFrame:
+    """Player stats with their compact types plus all the metrics derived from them
 
-    # 4.2 Defense statistics by minute played
-    df_player_stats['Steals'] = df_player_stats['Steals'].astype(int)
-    df_player_stats['BlockedShots'] = df_player_stats['BlockedShots'].astype(int)
-    df_player_stats['Defense'] = (df_player_stats['Steals'] + df_player_stats['BlockedShots']) / df_player_stats['Minutes']
-    df_player_stats.sort_values(by='Defense', ascending=False, inplace=True)
-
-    fig = plt.figure(figsize=(10, 5))
-    plt.bar(df_player_stats['Name'], df_player_stats['Steals'] / df_player_stats['Minutes'], color=colors[0], edgecolor='black')
-    plt.bar(df_player_stats['Name'], df_player_stats['BlockedShots'] / df_player_stats['Minutes'], bottom=df_player_stats['Steals'] / df_player_stats['Minutes'], color=colors[1], edgecolor='black')
-    plt.xlabel('Player')
-    plt.ylabel('Defensive Statistics')
-    plt.title('Defensive Statistics by minute played')
-    plt.legend(['Steals', 'Blocked Shots'])
-    plt.xticks(rotation=70)
-    # plt.show()
-    fig.savefig(f'{path}/defense_by_minute.png', bbox_inches='tight')
-    plt.close()
+    The given frame is not modified.
+    """
 
+    metrics = compact_player_stats(df_player_stats)
+    metrics['PointsPerMinute'] = metrics['Points'] / metrics['Minutes']
+    metrics['TwoPointerAccuracy'] = metrics['TwoPointersMade'] / metrics['TwoPointersAttempted']
+    metrics['ThreePointerAccuracy'] = metrics['ThreePointersMade'] / metrics['ThreePointersAttempted']
+    metrics['Defense'] = metrics['Steals'] + metrics['BlockedShots']
+    metrics['StealsPerMinute'] = metrics['Steals'] / metrics['Minutes']
+    metrics['BlockedShotsPerMinute'] = metrics['BlockedShots'] / metrics['Minutes']
+    metrics['DefensePerMinute'] = metrics['Defense'] / metrics['Minutes']
+    return metrics
 
-    # 5.1 Stacked Barplot on Two Pointers Made
-    df_player_stats['TwoPointersMade'] = df_player_stats['TwoPointersMade'].astype(int)
-    df_player_stats['TwoPointersAttempted'] = df_player_stats['TwoPointersAttempted'].astype(int)
-    df_player_stats.sort_values(by='TwoPointersAttempted', ascending=False, inplace=True)
-
-    fig, ax = plt.subplots(figsize=(10, 5))
-    plt.title('Two Pointers')
-    plt.bar(df_player_stats['Name'], df_player_stats['TwoPointersAttempted'], color='red')
-    plt.bar(df_player_stats['Name'], df_player_stats['TwoPointersMade'], color='green')
-    plt.xlabel('Player')
-    plt.ylabel('Two Pointers')
-    plt.legend(['Missed', 'Scored'])
-    plt.xticks(rotation=70)
-    # plt.show()
-    fig.savefig(f'{path}/two_pointers.png', bbox_inches='tight')
-    plt.close()
 
+def rank_indexes(metrics: pd.DataFrame) -> dict:
+    """Positions of the players from highest to lowest value of each ranked metric
+
+    NaN values go last, and ties keep the original order of the players.
+    """
+    return {metric: np.argsort(-metrics[metric].to_numpy(dtype=float), kind='stable') for metric in RANKED_METRICS}
+
+
+def ranked(metrics: pd.DataFrame, index: np.ndarray, column: str) -> tuple:
+    """Immutable copy of a column in the order of a rank index, small enough to send to another process"""
+    return tuple(metrics[column].to_numpy()[index].tolist())
+
+
+def chart_jobs(df_players: pd.DataFrame, df_schedules: pd.DataFrame, df_player_stats: pd.DataFrame, colors: list, name: str, team: str) -> list:
+    """Split the report graphs into independent jobs: (file name, chart function, arguments)"""
+
+    jobs = []
+
+    # 1.1 Table of Players
+    df_table_players = df_players[['Position', 'Height', 'Weight', 'BirthDate', 'BirthCountry', 'College', 'Salary']].copy()  # 'PhotoUrl'
+    df_table_players['BirthDate'] = df_table_players['BirthDate'].str[:10]
+    # We convert the height from feet to cm
+    df_table_players['Height'] = (df_table_players['Height'] * 2.54).round(1).astype(str) + ' cm'
+    player_names = df_players['FirstName'] + ' ' + df_players['LastName']
+    cells = tuple(tuple(row) for row in df_table_players.values.tolist())
+    jobs.append(('table_players', chart_table, (cells, tuple(df_table_players.columns), tuple(player_names), colors[0])))
+
+    metrics = compute_team_metrics(df_schedules, team)
+
+    # 1.2 PieChart on Win Rate
+    jobs.append(('win_rate', chart_pie, (metrics['win_rate'], f'Win Rate - {name}')))
+
+    # 1.3 PieChart on Win Rate Home
+    jobs.append(('win_rate_home', chart_pie, (metrics['win_rate_home'], f'Win Rate Home - {name}')))
+
+    # 1.4 PieChart on Win Rate Away
+    jobs.append(('win_rate_away', chart_pie, (metrics['win_rate_away'], f'Win Rate Away - {name}')))
+
+    metrics = player_metrics(df_player_stats)
+    ranks = rank_indexes(metrics)
+
+    # 2.1 Season Points
+    index = ranks['Points']
+    jobs.append(('points', chart_bar, (ranked(metrics, index, 'Name'), ranked(metrics, index, 'Points'), colors[0], 'Points', 'Points')))
+
+    # 2.2 Points per minute
+    index = ranks['PointsPerMinute']
+    jobs.append(('points_per_minute', chart_bar, (ranked(metrics, index, 'Name'), ranked(metrics, index, 'PointsPerMinute'), colors[1],
+                                                  'Points Per Minute', 'Points Per Minute')))
+
+    # 3.1 Grouped barplot on Shot Accuracy
+    index = ranks['TwoPointerAccuracy']
+    jobs.append(('shot_accuracy', chart_grouped_bar, (ranked(metrics, index, 'Name'), ranked(metrics, index, 'TwoPointerAccuracy'),
+                                                      ranked(metrics, index, 'ThreePointerAccuracy'), tuple(colors), 'Shot Accuracy', 'Percentage')))
+
+    # 3.2 Grouped barplot on Shots Scored
+    index = ranks['TwoPointersMade']
+    jobs.append(('shots_made', chart_grouped_bar, (ranked(metrics, index, 'Name'), ranked(metrics, index, 'TwoPointersMade'),
+                                                   ranked(metrics, index, 'ThreePointersMade'), tuple(colors), 'Shots Scored', 'Scored')))
+
+    # 3.3 Barplot on free throw percentage, only for the players who shot free throws
+    index = ranks['FreeThrowsPercentage']
+    index = index[metrics['FreeThrowsPercentage'].to_numpy()[index] > 0]
+    jobs.append(('free_throw_percentage', chart_free_throws, (ranked(metrics, index, 'Name'), ranked(metrics, index, 'FreeThrowsPercentage'), colors[0])))
+
+    # 4.1 Defense statistics
+    index = ranks['Defense']
+    jobs.append(('defense', chart_defense, (ranked(metrics, index, 'Name'), ranked(metrics, index, 'Steals'),
+                                            ranked(metrics, index, 'BlockedShots'), tuple(colors), 'Defensive Statistics')))
+
+    # 4.2 Defense statistics by minute played
+    index = ranks['DefensePerMinute']
+    jobs.append(('defense_by_minute', chart_defense, (ranked(metrics, index, 'Name'), ranked(metrics, index, 'StealsPerMinute'),
+                                                      ranked(metrics, index, 'BlockedShotsPerMinute'), tuple(colors),
+                                                      'Defensive Statistics by minute played')))
+
+    # 5.1 Stacked Barplot on Two Pointers Made
+    index = ranks['TwoPointersAttempted']
+    jobs.append(('two_pointers', chart_shots, (ranked(metrics, index, 'Name'), ranked(metrics, index, 'TwoPointersAttempted'),
+                                               ranked(metrics, index, 'TwoPointersMade'), 'Two Pointers')))
 
     # 5.2 Stacked Barplot on Three Pointers Made
-    df_player_stats['ThreePointersMade'] = df_player_stats['ThreePointersMade'].astype(int)
-    df_player_stats['ThreePointersAttempted'] = df_player_stats['ThreePointersAttempted'].astype(int)
-    df_player_stats.sort_values(by='ThreePointersAttempted', ascending=False, inplace=True)
-
-    fig, ax = plt.subplots(1, 1, figsize=(10, 5))
-    plt.title('Three Pointers')
-    ax.bar(df_player_stats['Name'], df_player_stats['ThreePointersAttempted'], color='red')
-    ax.bar(df_player_stats['Name'], df_player_stats['ThreePointersMade'], color='green')
-    ax.legend(['Missed', 'Scored'])
-    plt.xlabel('Player')
-    plt.ylabel('Three Pointers')
-    plt.xticks(rotation=70)
-    # plt.show()
-    fig.savefig(f'{path}/three_pointers.png', bbox_inches='tight')
-    plt.close()
+    index = ranks['ThreePointersAttempted']
+    jobs.append(('three_pointers', chart_shots, (ranked(metrics, index, 'Name'), ranked(metrics, index, 'ThreePointersAttempted'),
+                                                 ranked(metrics, index, 'ThreePointersMade'), 'Three Pointers')))
 
-    plt.close('all')
+    return jobs
 
 
-def web_scraping_nba_logos(name: str, path: str) -> None:
-    """Obtain NBA team logos through Web Scraping"""
-
-    # As the format of the photos in the df is svg, I have had
-    # to look for another way to get the logos of the teams
-    # I have had to search in the code of different websites until
-    # I found one that gave me the logos in png format. Then, I
-    # have used web scraping to obtain the logosfrom the website
-
-    logo_name = name + ' Transparent Logo'
-    url = "https://loodibee.com/nba/"
-    response = requests.get(url)
-    soup = BeautifulSoup(response.text, "html.parser")
-    logo_wall = soup.find('div', class_='logos-layout column-3')
-    teams = logo_wall.find_all('img',)
-    logos_dict = {}
-    for team in teams:
-        if 'srcset' in team.attrs:
-            logos_dict[team['alt']] = team['srcset']
-    logo = logos_dict[logo_name].split(' ')[-2]
-    response = requests.get(logo)
-    with open(f'{path}/logo_{name.replace(" ", "_")}.png', 'wb') as file:
-        file.write(response.content)
+def run_chart(job: tuple) -> bytes:
+    """Render the PNG of a chart job"""
+    (_, chart, args) = job
+    return chart(*args)
 
 
-def predict_winner(name: str) -> dict:
-    """Predict the winner of the next match of a given team"""
+def timed_chart(job: tuple) -> tuple[bytes, float]:
+    """Render the PNG of a chart job and measure how long it took"""
+    start = time.perf_counter()
+    image = run_chart(job)
+    return (image, time.perf_counter() - start)
+
+
+def render_charts(jobs: list, executor: ProcessPoolExecutor = None) -> list:
+    """Render the PNGs of the chart jobs, in the process pool when there is one"""
+
+    results = executor.map(timed_chart, jobs) if executor is not None else map(timed_chart, jobs)
+    images = []
+    for (file_name, _, _), (image, seconds) in zip(jobs, results):
+        record.chart(file_name, len(image), seconds)
+        images.append(image)
+    return images
+
+
+def job_hash(job: tuple) -> str:
+    """Hash of everything a chart depends on: its data slice and its parameters"""
+    (file_name, chart, args) = job
+    return hashlib.sha256(repr((file_name, chart.__name__, args)).encode()).hexdigest()
 
-    url = 'https://www.sportytrader.es/cuotas/baloncesto/usa/nba-306/'
-    response = requests.get(url)
-    soup = BeautifulSoup(response.text, 'html.parser')
-    bets = soup.find('div', class_="px-box mb-10")
-    # print(bets.prettify())
-    matches = bets.find_all('div', class_="cursor-pointer border rounded-md mb-4 px-1 py-2 flex flex-col lg:flex-row relative")
-    name_web_scraping = name.split(' ')[-1]
-    next_match_info = {}
-    for match in matches:
-        if name_web_scraping in match.span.a.text:
-            teams = match.span.a.text.split(' - ')
-            teams = [teams[0][1:], teams[1][:-1]]
-            if 'LA ' in teams[0]:
-                teams[0] = teams[0].replace('LA', 'Los Angeles')
-            elif 'LA ' in teams[1]:
-                teams[1] = teams[1].replace('LA', 'Los Angeles')
-
-            odds = match.find_all('span', class_='px-1 h-booklogosm font-bold bg-primary-yellow text-white leading-8 rounded-r-md w-14 md:w-18 flex justify-center items-center text-base')
-            odds = [odds[0].text, odds[1].text]
-            date = match.span.span.text
-            next_match_info = {'teams': teams, 'odds': odds, 'date': date}
-
-    return next_match_info
-
-
-class PDF(FPDF):
-
-    def Title(self, title, coords, size, color, border=0, center=False):
-        self.set_font('Arial', 'B', size)
-        self.set_text_color(color[0], color[1], color[2])
-        self.set_xy(coords[0], coords[1])
-        if not center:
-            self.cell(80, 10, title, border=border)
+
+def read_manifest(path: str) -> dict:
+    """Read the hashes of the charts and the PDF last built in the images directory"""
+
+    if not os.path.exists(f'{path}/manifest.json'):
+        return {'charts': {}, 'pdf': None}
+    with open(f'{path}/manifest.json', 'r') as file:
+        return json.load(file)
+
+
+def write_manifest(path: str, manifest: dict) -> None:
+    """Save the hashes of the charts and the PDF in the images directory"""
+    with open(f'{path}/manifest.json', 'w') as file:
+        json.dump(manifest, file, indent=2)
+
+
+def report_jobs(df_players: pd.DataFrame, df_schedules: pd.DataFrame, df_player_stats: pd.DataFrame, colors: list, name: str, team: str,
+                df_trends: pd.DataFrame = None) -> list:
+    """Chart jobs of the whole report, with the trend charts when the aggregates of several seasons are given"""
+
+    jobs = chart_jobs(df_players, df_schedules, df_player_stats, colors, name, team)
+    if df_trends is not None:
+        jobs += trend_jobs(df_trends, colors)
+    return jobs
+
+
+def graphs(df_players: pd.DataFrame, df_schedules: pd.DataFrame, df_player_stats: pd.DataFrame, path: str, colors: list, name: str, team: str,
+           executor: ProcessPoolExecutor = None, incremental: bool = False, df_trends: pd.DataFrame = None) -> bool:
+    """Create all the graphs for the report using the obtained dataframes
+
+    The charts are rendered in the given process pool when there is one, or
+    one after the other otherwise. In incremental mode only the charts whose
+    data or parameters changed since the last run are rendered again. With
+    the aggregates of several seasons the trend charts are also created.
+    Returns whether any chart was rendered.
+    """
+
+    manifest = read_manifest(path)
+    jobs = report_jobs(df_players, df_schedules, df_player_stats, colors, name, team, df_trends)
+    hashes = {job[0]: job_hash(job) for job in jobs}
+    if incremental:
+        jobs = [job for job in jobs
+                if manifest['charts'].get(job[0]) != hashes[job[0]] or not os.path.exists(f'{path}/{job[0]}.png')]
+
+    for (file_name, _, _), image in zip(jobs, render_charts(jobs, executor)):
+        with open(f'{path}/{file_name}.png', 'wb') as file:
+            file.write(image)
+
+    manifest['charts'] = hashes
+    write_manifest(path, manifest)
+    return len(jobs) > 0
+
+
+def iter_seasons(seasons: list, headers: dict, team: str = None, sync: bool = True):
+    """Yield the schedule and the player stats of each season, one season at a time
+
+    With a team only its player stats are loaded, from the stats store when
+    the season is there. Without a team the stats of every team are
+    downloaded (and saved in the store). With sync=False the schedules are
+    read from the game store as they are.
+    """
+
+    for season in seasons:
+        df_schedules = sync_schedule(season, headers, sync=sync)
+        if team is not None and os.path.exists(os.path.join(STATS_STORE, season, team)):
+            df_player_stats = load_player_stats(team, season)
+        elif team is not None:
+            url_player_stats = f"https://api.sportsdata.io/v3/nba/stats/json/PlayerSeasonStatsByTeam/{season}/{team}"
+            df_player_stats = extract_api(url_player_stats, headers, TTL['player_stats'])
         else:
-            self.cell(80, 10, title, border=border, align='C')
+            df_teams = extract_api("https://api.sportsdata.io/v3/nba/scores/json/teams", headers, TTL['teams'])
+            df_player_stats = extract_league_player_stats(season, headers, df_teams['Key'])
+            save_player_stats(df_player_stats, season)
+        yield (season, df_schedules, df_player_stats)
+
+
+def reduce_season(season: str, df_schedules: pd.DataFrame, df_player_stats: pd.DataFrame) -> list:
+    """Reduce a season to a few aggregates per team: win rates, scoring and shooting, and points per player"""
+
+    stats = compact_player_stats(df_player_stats)
+    totals = stats.groupby('Team', observed=True)[['Points', 'Minutes', 'TwoPointersMade', 'TwoPointersAttempted',
+                                                   'ThreePointersMade', 'ThreePointersAttempted']].sum()
+    rows = []
+    for (team, total) in totals.iterrows():
+        df_team_schedules = filter_schedules(df_schedules, team)
+        if df_team_schedules.empty:
+            continue
+        metrics = compute_team_metrics(df_team_schedules, team)
+        players = stats[(stats['Team'] == team) & (stats['Minutes'] > 0)]
+        rows.append({
+            'Season': season,
+            'Team': team,
+            'WinRate': metrics['win_rate'],
+            'WinRateHome': metrics['win_rate_home'],
+            'WinRateAway': metrics['win_rate_away'],
+            'PointsPerMinute': total['Points'] / total['Minutes'],
+            'TwoPointerAccuracy': total['TwoPointersMade'] / total['TwoPointersAttempted'],
+            'ThreePointerAccuracy': total['ThreePointersMade'] / total['ThreePointersAttempted'],
+            'PlayerPoints': dict(zip(players['Name'].astype(str), players['Points'].tolist())),
+            'PlayerPointsPerMinute': dict(zip(players['Name'].astype(str), (players['Points'] / players['Minutes']).tolist())),
+        })
+    return rows
+
+
+def get_trends(seasons: list, team: str = None, sync: bool = True) -> pd.DataFrame:
+    """Aggregates of every season, for a team or for the whole league
+
+    The seasons are streamed: each one is reduced to its aggregates before
+    the next one is loaded, so memory does not grow with the number of
+    seasons. With sync=False the schedules are not synced (see sync_schedule).
+    """
+
+    headers = get_headers()
+    rows = []
+    for (season, df_schedules, df_player_stats) in iter_seasons(seasons, headers, team, sync):
+        rows.extend(reduce_season(season, df_schedules, df_player_stats))
+    df_trends = pd.DataFrame(rows)
+    if team is not None and not df_trends.empty:
+        df_trends = df_trends[df_trends['Team'] == team].reset_index(drop=True)
+    return df_trends
+
+
+def chart_trend(seasons: tuple, series: tuple, colors: tuple, title: str, ylabel: str) -> bytes:
+    """Line chart of one or more statistics over the seasons"""
+
+    fig = figure(figsize=(10, 5))
+    ax = fig.add_subplot()
+    for (label, values), color in zip(series, colors):
+        ax.plot(seasons, values, marker='o', label=label, color=color)
+    ax.set_title(title)
+    ax.set_xlabel('Season')
+    ax.set_ylabel(ylabel)
+    ax.legend()
+    return render(fig, bbox_inches='tight')
+
+
+def trend_jobs(df_trends: pd.DataFrame, colors: list) -> list:
+    """Chart jobs of the trend pages of a team, from its aggregates per season"""
+
+    df_trends = df_trends.sort_values(by='Season')
+    seasons = tuple(df_trends['Season'].astype(str))
+
+    def values(column):
+        return tuple(df_trends[column].tolist())
+
+    jobs = []
+    jobs.append(('trend_win_rate', chart_trend, (seasons, (('Total', values('WinRate')), ('Home', values('WinRateHome')), ('Away', values('WinRateAway'))),
+                                                 ('black', colors[0], colors[1]), 'Win Rate', 'Win Rate')))
+    jobs.append(('trend_points_per_minute', chart_trend, (seasons, (('Team', values('PointsPerMinute')),), (colors[0],),
+                                                          'Points Per Minute', 'Points Per Minute')))
+    jobs.append(('trend_shot_accuracy', chart_trend, (seasons, (('Two Pointers', values('TwoPointerAccuracy')),
+                                                                ('Three Pointers', values('ThreePointerAccuracy'))),
+                                                      tuple(colors), 'Shot Accuracy', 'Percentage')))
+
+    # Top 5 scorers of the last season, and how their points per minute evolved
+    last = df_trends['PlayerPoints'].iloc[-1]
+    top_players = sorted(last, key=last.get, reverse=True)[:5]
+    series = tuple((player, tuple(season.get(player, np.nan) for season in df_trends['PlayerPointsPerMinute'])) for player in top_players)
+    jobs.append(('trend_players', chart_trend, (seasons, series, (None,) * len(series), 'Top Scorers Points Per Minute', 'Points Per Minute')))
+    return jobs
+
 
-    def Cover(self, name, season):
-        self.add_page()
-        self.set_font('Arial', 'B', 30)
-        self.set_xy(35, 60)
-        self.multi_cell(150, 30, f'{name}\n{season}-{int(season)+1} Season', border=1, align='C')
-        self.image(f'{path}/logo_{name.replace(" ", "_")}.png', 60, 130, 100)
-        self.set_font('Arial', 'B', 12)
-        self.set_xy(35, 250)
-        self.multi_cell(150, 10, 'Author\nIgnacio Bayón Jiménez-Ugarte', align='C')
+def normalize_team_name(name: str) -> str:
+    """Name of a team as a key of the logo index
 
+    The websites name the Los Angeles teams 'LA Clippers' or 'Los Angeles
+    Clippers', so both resolve to the same key.
+    """
 
-def pdf(name: str, season: str, path: str, next_match_info: dict):
-    pdf = PDF()
+    name = ' '.join(name.lower().replace(' transparent logo', '').split())
+    if name.startswith('la '):
+        name = 'los angeles ' + name[3:]
+    return name
+
+
+class LogoIndex:
+    """Local copy of the PNG logos of all the teams, indexed by normalized team name
+
+    The loodibee logo wall is parsed once and all the logos are downloaded
+    at the same time. The index is only refreshed when asked to, when it is
+    older than ttl, or once when it misses a team.
+    """
+
+    def __init__(self, path: str = 'logos', ttl: float = TTL['logos']):
+        self.path = path
+        self.ttl = ttl
+        self.index = None
+        # Whether the index was scraped by this process, rather than read from disk
+        self.refreshed = False
+        self.lock = threading.Lock()
+
+    def refresh(self) -> None:
+        """Scrape the logo wall and download the logos of all the teams"""
+
+        # As the format of the photos in the df is svg, I have had
+        # to look for another way to get the logos of the teams
+        # I have had to search in the code of different websites until
+        # I found one that gave me the logos in png format. Then, I
+        # have used web scraping to obtain the logosfrom the website
+
+        from bs4 import BeautifulSoup
+        soup = BeautifulSoup(fetch(LOGOS_URL, 0).decode(), "html.parser")
+        logo_wall = soup.find('div', class_='logos-layout column-3')
+        teams = logo_wall.find_all('img',)
+        logos_dict = {}
+        for team in teams:
+            if 'srcset' in team.attrs:
+                # We keep the largest image of the srcset
+                logos_dict[normalize_team_name(team['alt'])] = team['srcset'].split(' ')[-2]
+
+        directory(self.path)
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            images = executor.map(lambda url: fetch(url, TTL['logos']), logos_dict.values())
+            files = {}
+            for (key, image) in zip(logos_dict, images):
+                files[key] = f'{key.replace(" ", "_")}.png'
+                write_file(os.path.join(self.path, files[key]), image)
+
+        # The index is written last, so a reader never finds a logo it lists half written
+        self.index = {'updated_at': time.time(), 'logos': files}
+        write_file(os.path.join(self.path, 'index.json'), json.dumps(self.index, indent=2).encode())
+        self.refreshed = True
+
+    def load(self) -> dict:
+        """Read the index from disk, refreshing it when it is missing or stale"""
+
+        with self.lock:
+            if self.index is None and os.path.exists(os.path.join(self.path, 'index.json')):
+                with open(os.path.join(self.path, 'index.json'), 'r') as file:
+                    self.index = json.load(file)
+            if self.index is None or time.time() - self.index['updated_at'] >= self.ttl:
+                self.refresh()
+            return self.index
+
+    def file(self, name: str) -> str:
+        """Local PNG file of the logo of a team
+
+        A team missing from an index read from disk refreshes it once before
+        failing, as it may have been renamed or added to the wall since.
+        """
+
+        key = normalize_team_name(name)
+        if key not in self.load()['logos']:
+            with self.lock:
+                if not self.refreshed:
+                    self.refresh()
+        return os.path.join(self.path, self.index['logos'][key])
+
+
+# Logos of all the teams, shared by every report
+logo_index = LogoIndex()
+
+
+def get_logo(name: str) -> bytes:
+    """Obtain the PNG logo of a NBA team from the logo index"""
+
+    with open(logo_index.file(name), 'rb') as file:
+        return file.read()
+
+
+def web_scraping_nba_logos(name: str, path: str) -> None:
+    """Save the logo of a NBA team in the images directory"""
+
+    with open(f'{path}/logo_{name.replace(" ", "_")}.png', 'wb') as file:
+        file.write(get_logo(name))
+
+
+def parse_match_date(date: str) -> datetime:
+    """Date of a match as shown on the odds board, or None if its format is unknown"""
+
+    now = datetime.now()
+    for date_format in ('%d/%m %H:%M', '%d/%m/%Y %H:%M', '%d.%m. %H:%M', '%d/%m'):
+        if '%Y' in date_format:
+            try:
+                return datetime.strptime(date.strip(), date_format)
+            except ValueError:
+                continue
+        # The board does not show the year, the match is in the next occurrence of that day. The
+        # year is parsed with the day, as the 29th of February only exists in leap years
+        for year in (now.year, now.year + 1):
+            try:
+                parsed = datetime.strptime(f'{date.strip()} {year}', f'{date_format} %Y')
+            except ValueError:
+                continue
+            if parsed >= now - timedelta(days=180):
+                return parsed
+    return None
+
+
+def last_line(file) -> bytes:
+    """Last line of a file opened in binary mode, reading only the end of the file"""
+
+    end = file.seek(0, os.SEEK_END)
+    size = 4096
+    while True:
+        start = file.seek(max(0, end - size))
+        lines = file.read(end - start).rstrip(b'\n').split(b'\n')
+        if len(lines) > 1 or start == 0:
+            return lines[-1]
+        size *= 2
+
+
+class OddsBoard:
+    """Snapshot of the odds of every upcoming NBA match
+
+    The sportytrader board is scraped once into a table of matches, shared by
+    the reports of all the teams until it is older than ttl. Every snapshot
+    that differs from the last one is appended to a history file, with the
+    time the board was downloaded, so the odds can be analysed later.
+    """
+
+    def __init__(self, history_file: str = 'odds_history.jsonl', ttl: float = TTL['odds']):
+        self.history_file = history_file
+        self.ttl = ttl
+        self.matches = None
+        self.taken_at = None
+        self.refreshed_at = None
+        self.lock = threading.Lock()
+
+    def refresh(self) -> list:
+        """Scrape the board and save a new snapshot"""
+
+        from bs4 import BeautifulSoup
+        soup = BeautifulSoup(fetch(ODDS_URL, TTL['odds']).decode(), 'html.parser')
+        bets = soup.find('div', class_="px-box mb-10")
+        # print(bets.prettify())
+        rows = bets.find_all('div', class_="cursor-pointer border rounded-md mb-4 px-1 py-2 flex flex-col lg:flex-row relative")
+        matches = []
+        for position, match in enumerate(rows):
+            try:
+                teams = match.span.a.text.split(' - ')
+                teams = [teams[0][1:], teams[1][:-1]]
+                odds = match.find_all('span', class_='px-1 h-booklogosm font-bold bg-primary-yellow text-white leading-8 rounded-r-md w-14 md:w-18 flex justify-center items-center text-base')
+                odds = [odds[0].text, odds[1].text]
+                date = match.span.span.text
+            except (AttributeError, IndexError):
+                # Rows that are not a match (futures, live or promoted blocks) are skipped, not the whole board
+                continue
+            teams = [team.replace('LA', 'Los Angeles', 1) if team.startswith('LA ') else team for team in teams]
+            matches.append({'teams': teams, 'odds': odds, 'date': date, 'position': position})
+
+        # The board may come from the cache, so the snapshot is as old as the cached page
+        self.matches = matches
+        self.taken_at = cache.fetched_at(ODDS_URL) or time.time()
+        self.refreshed_at = time.time()
+        self.save()
+        return matches
+
+    def save(self) -> None:
+        """Append the snapshot to the history file, unless the last snapshot has the same matches"""
+
+        # Every process (workers, servers, stages) saves its snapshots, so the file is locked
+        # between reading the last snapshot and appending the new one
+        with open(self.history_file, 'a+b') as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            last = last_line(file)
+            if last and json.loads(last)['matches'] == self.matches:
+                return
+            file.write((json.dumps({'taken_at': self.taken_at, 'matches': self.matches}) + '\n').encode())
+
+    def load(self) -> list:
+        """Matches of the current snapshot, taking a new one when there is none or it is stale"""
+
+        with self.lock:
+            if self.matches is None or time.time() - self.refreshed_at >= self.ttl:
+                self.refresh()
+            return self.matches
+
+    def next_match(self, name: str) -> dict:
+        """Earliest upcoming match of a team: teams, odds and date ({} if there is none)"""
+
+        name_web_scraping = name.split(' ')[-1]
+        matches = [match for match in self.load() if any(name_web_scraping in team for team in match['teams'])]
+        if not matches:
+            return {}
+        # Matches with a date we can not read go after the dated ones, in the order of the board
+        match = min(matches, key=lambda match: (parse_match_date(match['date']) or datetime.max, match['position']))
+        return {'teams': match['teams'], 'odds': match['odds'], 'date': match['date']}
+
+
+# Odds of the upcoming matches, shared by every report
+odds_board = OddsBoard()
+
+
+def predict_winner(name: str) -> dict:
+    """Predict the winner of the next match of a given team"""
+    return odds_board.next_match(name)
+
+
+# Charts that can be drawn in the PDF as vector graphics: chart function -> PDF method
+VECTOR_CHARTS = {
+    chart_table: 'Table',
+    chart_pie: 'Pie',
+    chart_bar: 'Bars',
+    chart_grouped_bar: 'GroupedBars',
+    chart_free_throws: 'FreeThrows',
+    chart_defense: 'Defense',
+    chart_shots: 'Shots',
+    chart_trend: 'Trend',
+}
+
+# RGB of the named colors of the charts, and the colors matplotlib cycles through when a line has none
+NAMED_COLORS = {'black': (0, 0, 0), 'white': (255, 255, 255), 'green': (0, 128, 0), 'red': (255, 0, 0)}
+COLOR_CYCLE = ('#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd', '#8c564b', '#e377c2', '#7f7f7f', '#bcbd22', '#17becf')
+
+
+def rgb(color: str) -> tuple:
+    """RGB (0-255) of a chart color, given by name or as #RRGGBB"""
+
+    if color in NAMED_COLORS:
+        return NAMED_COLORS[color]
+    return tuple(int(color[i:i + 2], 16) for i in (1, 3, 5))
+
+
+def ticks(low: float, high: float, count: int = 5) -> list:
+    """Round values (steps of 1, 2, 2.5 or 5 times a power of ten) covering [low, high]"""
+
+    if not high > low:
+        high = low + 1
+    step = (high - low) / count
+    magnitude = 10 ** math.floor(math.log10(step))
+    step = next(multiple * magnitude for multiple in (1, 2, 2.5, 5, 10) if multiple * magnitude >= step)
+    first = math.floor(low / step) * step
+    return [first + i * step for i in range(math.ceil((high - first) / step - 1e-9) + 1)]
+
+
+def latin1(text: str) -> str:
+    """Text the core fonts of the PDF can encode: accented letters outside latin-1 lose their accent"""
+
+    text = ''.join(char if ord(char) < 256 else unicodedata.normalize('NFKD', char)[0] for char in str(text))
+    return text.encode('latin-1', 'replace').decode('latin-1')
+
+
+def pdf_class() -> type:
+    """Return the PDF class of the reports, importing fpdf and Pillow only when a PDF is built"""
+
+    global PDF
+    if PDF is not None:
+        return PDF
+
+    from fpdf import FPDF
+    from PIL import Image
+
+    class PDF(FPDF):
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            # PNG images kept in memory, by the name they are placed with
+            self.buffers = {}
+            # Charts drawn as vector graphics instead of placing their PNG: name -> (chart function, arguments)
+            self.charts = {}
+
+        def add_buffer(self, name, data):
+            self.buffers[name] = data
+
+        def add_chart(self, name, chart, args):
+            self.charts[name] = (chart, args)
+
+        def _parsepng(self, name):
+            # FPDF can only read images from files and splits the alpha channel
+            # byte by byte with regular expressions, so we decode the PNG with
+            # Pillow instead, from memory when it was added with add_buffer
+            if name in self.buffers:
+                image = Image.open(io.BytesIO(self.buffers[name]))
+            else:
+                image = Image.open(name)
+            pixels = np.asarray(image.convert('RGBA'))
+            (h, w) = pixels.shape[:2]
+            info = {'w': w, 'h': h, 'cs': 'DeviceRGB', 'bpc': 8, 'f': 'FlateDecode', 'pal': '', 'trns': '',
+                    'data': zlib.compress(pixels[:, :, :3].tobytes())}
+            alpha = pixels[:, :, 3]
+            if (alpha != 255).any():
+                # The soft mask is written with the PNG predictor, so each row starts with its filter type (0)
+                rows = np.hstack([np.zeros((h, 1), dtype=np.uint8), alpha])
+                info['smask'] = zlib.compress(rows.tobytes())
+                if self.pdf_version < '1.4':
+                    self.pdf_version = '1.4'
+            return info
+
+        def Title(self, title, coords, size, color, border=0, center=False):
+            self.set_font('Arial', 'B', size)
+            self.set_text_color(color[0], color[1], color[2])
+            self.set_xy(coords[0], coords[1])
+            if not center:
+                self.cell(80, 10, title, border=border)
+            else:
+                self.cell(80, 10, title, border=border, align='C')
+
+        def Cover(self, name, season, path):
+            self.add_page()
+            self.set_font('Arial', 'B', 30)
+            self.set_xy(35, 60)
+            self.multi_cell(150, 30, f'{name}\n{season}-{int(season)+1} Season', border=1, align='C')
+            self.image(f'{path}/logo_{name.replace(" ", "_")}.png', 60, 130, 100)
+            self.set_font('Arial', 'B', 12)
+            self.set_xy(35, 250)
+            self.multi_cell(150, 10, 'Author\nIgnacio Bayón Jiménez-Ugarte', align='C')
+
+        def Chart(self, path, name, x, y, w):
+            """Place a chart: drawn as vector graphics when it was added with add_chart, as its PNG otherwise"""
+            if name in self.charts:
+                (chart, args) = self.charts[name]
+                getattr(self, VECTOR_CHARTS[chart])(x, y, w, *args)
+            else:
+                self.image(f'{path}/{name}.png', x, y, w)
+
+        def _point(self, x, y):
+            # PDF operators take points from the bottom of the page, FPDF millimeters from the top
+            return (x * self.k, (self.h - y) * self.k)
+
+        def Polygon(self, points, style='F'):
+            path = ['%.2F %.2F m' % self._point(*points[0])] + ['%.2F %.2F l' % self._point(*point) for point in points[1:]]
+            self._out(' '.join(path) + ' h ' + {'F': 'f', 'D': 'S', 'DF': 'B'}[style])
+
+        def RotatedText(self, x, y, angle, text):
+            (cos, sin) = (math.cos(math.radians(angle)), math.sin(math.radians(angle)))
+            s = 'BT %.3F %.3F %.3F %.3F %.2F %.2F Tm (%s) Tj ET' % ((cos, sin, -sin, cos) + self._point(x, y) + (self._escape(text),))
+            if self.color_flag:
+                s = f'q {self.text_color} {s} Q'
+            self._out(s)
+
+        def CenteredText(self, x, y, text):
+            self.text(x - self.get_string_width(text) / 2, y, text)
+
+        def Legend(self, x, y, entries):
+            """Legend in the top right corner (x, y) of a plot: (label, color) entries"""
+            self.set_font('Arial', '', 6)
+            width = max(self.get_string_width(latin1(label)) for (label, _) in entries) + 8
+            self.set_draw_color(200)
+            self.set_fill_color(255)
+            self.rect(x - width - 1, y + 1, width, 3.5 * len(entries) + 1, 'DF')
+            for i, (label, color) in enumerate(entries):
+                self.set_fill_color(*rgb(color))
+                self.rect(x - width, y + 2 + 3.5 * i, 4, 2.5, 'F')
+                self.text(x - width + 5, y + 4.1 + 3.5 * i, latin1(label))
+            self.set_draw_color(0)
+
+        def Axes(self, x, y, w, h, title, xlabel, ylabel, labels, low, high, rotation=70):
+            """Draw the title, frame, ticks and labels of a chart with a category per label
+
+            Returns the plot area (x, y, w, h) and the page height of a value.
+            """
+            values = ticks(low, high)
+            tick_labels = ['%g' % round(value, 6) for value in values]
+            labels = [latin1(label) for label in labels]
+            self.set_font('Arial', '', 6)
+            self.set_text_color(0)
+            self.set_draw_color(0)
+            self.set_line_width(0.2)
+            label_height = max((self.get_string_width(label) for label in labels), default=0) * math.sin(math.radians(rotation)) + 3
+            left = max(self.get_string_width(label) for label in tick_labels) + 7
+            (px, py) = (x + left, y + 7)
+            (pw, ph) = (w - left - 2, h - 7 - min(label_height, h * 0.35) - 5)
+
+            def height(value):
+                return py + ph - (value - values[0]) / (values[-1] - values[0]) * ph
+
+            self.rect(px, py, pw, ph)
+            for (value, label) in zip(values, tick_labels):
+                self.line(px - 1, height(value), px, height(value))
+                self.text(px - 1.5 - self.get_string_width(label), height(value) + 0.8, label)
+            slot = pw / max(len(labels), 1)
+            for (i, label) in enumerate(labels):
+                center = px + slot * (i + 0.5)
+                self.line(center, py + ph, center, py + ph + 1)
+                length = self.get_string_width(label)
+                if rotation:
+                    # The label ends under its tick
+                    self.RotatedText(center - length * math.cos(math.radians(rotation)) + 0.7,
+                                     py + ph + 2 + length * math.sin(math.radians(rotation)), rotation, label)
+                else:
+                    self.CenteredText(center, py + ph + 3.5, label)
+            self.CenteredText(px + pw / 2, y + h - 1, xlabel)
+            self.RotatedText(x + 3, py + ph / 2 + self.get_string_width(ylabel) / 2, 90, ylabel)
+            self.set_font('Arial', '', 9)
+            self.CenteredText(px + pw / 2, y + 5, latin1(title))
+            return (px, py, pw, ph, height)
+
+        def _bars(self, px, slot, height, bars, edge=False):
+            """Draw bars in their category slots: (offset, width, bottoms, tops, color) per series"""
+            for (offset, width, bottoms, tops, color) in bars:
+                self.set_fill_color(*rgb(color))
+                for (i, (bottom, top)) in enumerate(zip(bottoms, tops)):
+                    if math.isfinite(bottom) and math.isfinite(top) and top != bottom:
+                        (y0, y1) = sorted((height(bottom), height(top)))
+                        self.rect(px + slot * (i + offset), y0, slot * width, y1 - y0, 'DF' if edge else 'F')
+
+        def Bars(self, x, y, w, names, values, color, title, ylabel):
+            finite = [value for value in values if math.isfinite(value)]
+            (px, py, pw, ph, height) = self.Axes(x, y, w, w * 0.68, title, 'Player', ylabel, names,
+                                                 min(finite + [0]), max(finite + [0]))
+            self._bars(px, pw / max(len(names), 1), height, [(0.1, 0.8, [0] * len(values), values, color)])
+
+        def GroupedBars(self, x, y, w, names, two_pointers, three_pointers, colors, title, ylabel):
+            finite = [value for value in two_pointers + three_pointers if math.isfinite(value)]
+            (px, py, pw, ph, height) = self.Axes(x, y, w, w * 0.49, title, '', ylabel, names,
+                                                 min(finite + [0]), max(finite + [0]))
+            zeros = [0] * len(names)
+            self._bars(px, pw / max(len(names), 1), height, [(0.15, 0.35, zeros, two_pointers, colors[0]),
+                                                             (0.5, 0.35, zeros, three_pointers, colors[1])], edge=True)
+            self.Legend(px + pw, py, [('Two Pointers', colors[0]), ('Three Pointers', colors[1])])
+
+        def Defense(self, x, y, w, names, steals, blocked_shots, colors, title):
+            tops = [steal + block for (steal, block) in zip(steals, blocked_shots)]
+            finite = [value for value in tops if math.isfinite(value)]
+            (px, py, pw, ph, height) = self.Axes(x, y, w, w * 0.68, title, 'Player', 'Defensive Statistics', names,
+                                                 min(finite + [0]), max(finite + [0]))
+            self._bars(px, pw / max(len(names), 1), height, [(0.1, 0.8, [0] * len(names), steals, colors[0]),
+                                                             (0.1, 0.8, steals, tops, colors[1])], edge=True)
+            self.Legend(px + pw, py, [('Steals', colors[0]), ('Blocked Shots', colors[1])])
+
+        def Shots(self, x, y, w, names, attempted, made, title):
+            finite = [value for value in attempted + made if math.isfinite(value)]
+            (px, py, pw, ph, height) = self.Axes(x, y, w, w * 0.68, title, 'Player', title, names,
+                                                 min(finite + [0]), max(finite + [0]))
+            zeros = [0] * len(names)
+            self._bars(px, pw / max(len(names), 1), height, [(0.1, 0.8, zeros, attempted, 'red'),
+                                                             (0.1, 0.8, zeros, made, 'green')])
+            self.Legend(px + pw, py, [('Missed', 'red'), ('Scored', 'green')])
+
+        def FreeThrows(self, x, y, w, names, percentages, color):
+            # Horizontal bars from 0 to 100, the first player at the bottom
+            h = w * 0.49
+            names = [latin1(name) for name in names]
+            self.set_font('Arial', '', 6)
+            self.set_text_color(0)
+            self.set_draw_color(0)
+            self.set_line_width(0.2)
+            left = max((self.get_string_width(name) for name in names), default=0) + 7
+            (px, py, pw, ph) = (x + left, y + 7, w - left - 2, h - 7 - 9)
+            self.rect(px, py, pw, ph)
+            for value in ticks(0, 100):
+                self.line(px + value / 100 * pw, py + ph, px + value / 100 * pw, py + ph + 1)
+                self.CenteredText(px + value / 100 * pw, py + ph + 3.5, '%g' % value)
+            slot = ph / max(len(names), 1)
+            self.set_fill_color(*rgb(color))
+            for (i, (name, percentage)) in enumerate(zip(names, percentages)):
+                center = py + ph - slot * (i + 0.5)
+                self.line(px - 1, center, px, center)
+                self.text(px - 1.5 - self.get_string_width(name), center + 0.8, name)
+                if math.isfinite(percentage):
+                    self.rect(px, center - slot * 0.4, min(percentage, 100) / 100 * pw, slot * 0.8, 'F')
+            self.CenteredText(px + pw / 2, y + h - 1, 'Player')
+            self.RotatedText(x + 3, py + ph / 2 + self.get_string_width('Free Throw Percentage') / 2, 90, 'Free Throw Percentage')
+            self.set_font('Arial', '', 9)
+            self.CenteredText(px + pw / 2, y + 5, 'Free Throw Percentage')
+
+        def Pie(self, x, y, w, win_rate, title):
+            # Wedges counterclockwise from the top, the Win wedge pulled out
+            h = w * 0.8
+            self.set_font('Arial', '', 9)
+            self.set_text_color(0)
+            self.CenteredText(x + w / 2, y + 5, latin1(title))
+            radius = min(w, h - 8) * 0.38
+            (cx, cy) = (x + w / 2, y + 8 + (h - 8) / 2)
+            self.set_font('Arial', '', 7)
+            if math.isnan(win_rate):
+                self.CenteredText(cx, cy, 'No games')
+                return
+            wedges = []
+            start = 90
+            for (label, share, color, explode) in (('Win', win_rate, 'green', 0.1), ('Lose', 1 - win_rate, 'red', 0)):
+                end = start + 360 * share
+                middle = math.radians((start + end) / 2)
+                (ox, oy) = (cx + explode * radius * math.cos(middle), cy - explode * radius * math.sin(middle))
+                if share > 0:
+                    steps = max(2, math.ceil((end - start) / 3))
+                    arc = [(ox + radius * math.cos(math.radians(start + (end - start) * i / steps)),
+                            oy - radius * math.sin(math.radians(start + (end - start) * i / steps))) for i in range(steps + 1)]
+                    wedges.append((arc if share >= 1 else [(ox, oy)] + arc, label, share, color, ox, oy, middle))
+                start = end
+            # The shadows go under every wedge
+            self.set_fill_color(110)
+            for (points, *_) in wedges:
+                self.Polygon([(px - 0.02 * radius, py + 0.02 * radius) for (px, py) in points], 'F')
+            for (points, label, share, color, ox, oy, middle) in wedges:
+                self.set_fill_color(*rgb(color))
+                self.Polygon(points, 'F')
+                self.CenteredText(ox + 0.6 * radius * math.cos(middle), oy - 0.6 * radius * math.sin(middle) + 1, '%1.1f%%' % (share * 100))
+                self.CenteredText(ox + 1.15 * radius * math.cos(middle), oy - 1.15 * radius * math.sin(middle) + 1, label)
+
+        def Trend(self, x, y, w, seasons, series, colors, title, ylabel):
+            finite = [value for (_, values) in series for value in values if math.isfinite(value)] or [0]
+            (low, high) = (min(finite), max(finite))
+            margin = (high - low) * 0.05 or 0.5
+            (px, py, pw, ph, height) = self.Axes(x, y, w, w * 0.52, title, 'Season', ylabel, seasons,
+                                                 low - margin, high + margin, rotation=0)
+            slot = pw / max(len(seasons), 1)
+            colors = [color or COLOR_CYCLE[i % len(COLOR_CYCLE)] for (i, color) in enumerate(colors)]
+            self.set_line_width(0.4)
+            for ((_, values), color) in zip(series, colors):
+                self.set_draw_color(*rgb(color))
+                self.set_fill_color(*rgb(color))
+                points = [(px + slot * (i + 0.5), height(value)) if math.isfinite(value) else None for (i, value) in enumerate(values)]
+                for (a, b) in zip(points, points[1:]):
+                    if a is not None and b is not None:
+                        self.line(*a, *b)
+                for point in points:
+                    if point is not None:
+                        self.Polygon([(point[0] + 0.8 * math.cos(math.radians(angle)), point[1] + 0.8 * math.sin(math.radians(angle)))
+                                      for angle in range(0, 360, 45)], 'F')
+            self.set_line_width(0.2)
+            self.set_draw_color(0)
+            self.Legend(px + pw, py, [(label, color) for ((label, _), color) in zip(series, colors)])
+
+        def Table(self, x, y, w, cells, columns, rows, color):
+            # The header and the player names on the team color, in the same height of the page as the matplotlib table
+            (y, h) = (y + w * 0.06, w * 0.385)
+            # Missing values (None or nan) are left blank, as in the matplotlib table
+            table = [[''] + [latin1(column) for column in columns]] + [[latin1(row)] + [latin1('' if pd.isna(cell) else cell) for cell in cells_row]
+                                                                       for (row, cells_row) in zip(rows, cells)]
+            row_height = h / len(table)
+            size = min(8, row_height * 72 / 25.4 * 0.6)
+            self.set_font('Arial', '', size)
+            widths = [max(self.get_string_width(row[j]) for row in table) + 2 for j in range(len(table[0]))]
+            if sum(widths) > w:
+                # We shrink the text until the widest cell of every column fits
+                size *= w / sum(widths)
+                self.set_font('Arial', '', size)
+            widths = [width * w / sum(widths) for width in widths]
+            (red, green, blue) = rgb(color)
+            header_text = 0 if 0.299 * red + 0.587 * green + 0.114 * blue > 128 else 255
+            self.set_fill_color(red, green, blue)
+            self.set_draw_color(0)
+            self.set_line_width(0.2)
+            for (i, row) in enumerate(table):
+                self.set_xy(x, y + i * row_height)
+                for (j, text) in enumerate(row):
+                    if i == 0 and j == 0:
+                        self.set_x(self.get_x() + widths[0])
+                        continue
+                    fill = i == 0 or j == 0
+                    self.set_text_color(header_text if fill else 0)
+                    self.cell(widths[j], row_height, text, border=1, align='C', fill=fill)
+
+    return PDF
+
+
+# PDF class of the reports, see pdf_class
+PDF = None
+
+
+def pdf(name: str, season: str, path: str, next_match_info: dict, images: dict = None, save: bool = True,
+        trends: bool = False, jobs: list = None) -> bytes:
+    """Create the PDF report and return it as bytes
+
+    The images are read from the images directory, or taken from the `images`
+    dictionary (file name without extension -> PNG bytes) when given, in which
+    case nothing is read from disk. With save=False the PDF is not written to
+    a file either. With trends=True the trend pages are added. The charts of
+    the given jobs are drawn as vector graphics instead of placing their PNG.
+    """
+
+    pdf = pdf_class()()
     pdf.set_author('Ignacio Bayón Jiménez-Ugarte')
     pdf.set_title(f'{name} - {season} Season')
-    pdf.Cover(name, season)
+    if images is not None:
+        for (file_name, image) in images.items():
+            pdf.add_buffer(f'{path}/{file_name}.png', image)
+    for (file_name, chart, args) in jobs or []:
+        pdf.add_chart(file_name, chart, args)
+    pdf.Cover(name, season, path)
 
     # GENERAL STATISTICS PAGE
     pdf.add_page()
     pdf.Title('General Statistics', coords=(40, 10), size=20, color=(0, 0, 0))
     pdf.Title("Players' General Information", coords=(20, 30), size=16, color=(0, 51, 102))
-    pdf.image(f'{path}/table_players.png', 10, 45, 200)
+    pdf.Chart(path, 'table_players', 10, 45, 200)
     pdf.Title('Win Rate', coords=(20, 170), size=16, color=(0, 51, 102))
-    pdf.image(f'{path}/win_rate.png', 0, 185, 120)
+    pdf.Chart(path, 'win_rate', 0, 185, 120)
     pdf.Title('Win Rate Home vs Away', coords=(120, 140), size=14, color=(0, 51, 102))
-    pdf.image(f'{path}/win_rate_home.png', 120, 155, 80)
+    pdf.Chart(path, 'win_rate_home', 120, 155, 80)
     pdf.Title('Loss Rate Home vs Away', coords=(120, 220), size=14, color=(0, 51, 102))
-    pdf.image(f'{path}/win_rate_away.png', 120, 235, 80)
+    pdf.Chart(path, 'win_rate_away', 120, 235, 80)
 
     # Points Statistics Page
     pdf.add_page()
     pdf.Title('Points Statistics', coords=(40, 10), size=20, color=(0, 0, 0))
     pdf.Title('- Points', coords=(20, 30), size=16, color=(0, 51, 102))
-    pdf.image(f'{path}/points.png', 20, 45, 160)
+    pdf.Chart(path, 'points', 20, 45, 160)
     pdf.Title('- Points Per Minute', coords=(20, 160), size=16, color=(0, 51, 102))
-    pdf.image(f'{path}/points_per_minute.png', 20, 175, 160)
+    pdf.Chart(path, 'points_per_minute', 20, 175, 160)
 
     # Shot Statistics Page
     pdf.add_page()
     pdf.Title('Shot Statistics', coords=(40, 10), size=20, color=(0, 0, 0))
     pdf.Title('- Shot Accuracy', coords=(20, 30), size=16, color=(0, 51, 102))
-    pdf.image(f'{path}/shot_accuracy.png', 40, 45, 130)
+    pdf.Chart(path, 'shot_accuracy', 40, 45, 130)
     pdf.Title('Total Field Shots Made', coords=(20, 120), size=16, color=(0, 51, 102))
-    pdf.image(f'{path}/shots_made.png', 40, 135, 130)
+    pdf.Chart(path, 'shots_made', 40, 135, 130)
     pdf.Title('- Free Throw Percentage', coords=(20, 210), size=16, color=(0, 51, 102))
-    pdf.image(f'{path}/free_throw_percentage.png', 40, 225, 130)
+    pdf.Chart(path, 'free_throw_percentage', 40, 225, 130)
 
     # Two Pointers vs Three Pointers Page
     pdf.add_page()
     pdf.Title('Shot Statistics', coords=(40, 10), size=20, color=(0, 0, 0))
     pdf.Title('- Two Pointers', coords=(20, 30), size=16, color=(0, 51, 102))
-    pdf.image(f'{path}/two_pointers.png', 20, 45, 160)
+    pdf.Chart(path, 'two_pointers', 20, 45, 160)
     pdf.Title('- Three Pointers', coords=(20, 160), size=16, color=(0, 51, 102))
-    pdf.image(f'{path}/three_pointers.png', 20, 175, 160)
+    pdf.Chart(path, 'three_pointers', 20, 175, 160)
 
     # Defense Statistics Page
     pdf.add_page()
     pdf.Title('Defensive Statistics', coords=(40, 10), size=20, color=(0, 0, 0))
     pdf.Title('- Defense', coords=(20, 30), size=16, color=(0, 51, 102))
-    pdf.image(f'{path}/defense.png', 20, 45, 160)
+    pdf.Chart(path, 'defense', 20, 45, 160)
     pdf.Title('- Defensive Stats by Minute', coords=(20, 160), size=16, color=(0, 51, 102))
-    pdf.image(f'{path}/defense_by_minute.png', 20, 175, 160)
+    pdf.Chart(path, 'defense_by_minute', 20, 175, 160)
+
+    # Trend Pages
+    if trends:
+        pdf.add_page()
+        pdf.Title('Season Trends', coords=(40, 10), size=20, color=(0, 0, 0))
+        pdf.Title('- Win Rate', coords=(20, 30), size=16, color=(0, 51, 102))
+        pdf.Chart(path, 'trend_win_rate', 20, 45, 160)
+        pdf.Title('- Points Per Minute', coords=(20, 160), size=16, color=(0, 51, 102))
+        pdf.Chart(path, 'trend_points_per_minute', 20, 175, 160)
+
+        pdf.add_page()
+        pdf.Title('Season Trends', coords=(40, 10), size=20, color=(0, 0, 0))
+        pdf.Title('- Shot Accuracy', coords=(20, 30), size=16, color=(0, 51, 102))
+        pdf.Chart(path, 'trend_shot_accuracy', 20, 45, 160)
+        pdf.Title('- Top Scorers', coords=(20, 160), size=16, color=(0, 51, 102))
+        pdf.Chart(path, 'trend_players', 20, 175, 160)
 
     # Next Match Page
     if len(next_match_info) != 0:
@@ -428,8 +1846,11 @@ def pdf(name: str, season: str, path: str, next_match_info: dict):
         pdf.Title('Next Match Prediction', coords=(40, 10), size=20, color=(0, 0, 0))
         pdf.Title(next_match_info['teams'][0], coords=(25, 30), size=16, color=(0, 51, 102), border=1, center=True)
         pdf.Title(next_match_info['teams'][1], coords=(105, 30), size=16, color=(0, 51, 102), border=1, center=True)
-        web_scraping_nba_logos(next_match_info['teams'][0], path)
-        web_scraping_nba_logos(next_match_info['teams'][1], path)
+        for team in next_match_info['teams']:
+            if images is None:
+                web_scraping_nba_logos(team, path)
+            else:
+                pdf.add_buffer(f'{path}/logo_{team.replace(" ", "_")}.png', get_logo(team))
         pdf.image(f'{path}/logo_{next_match_info["teams"][0].replace(" ", "_")}.png', 30, 45, 70)
         pdf.image(f'{path}/logo_{next_match_info["teams"][1].replace(" ", "_")}.png', 110, 45, 70)
         pdf.Title(next_match_info['odds'][0], coords=(25, 110), size=16, color=(0, 51, 102), center=True)
@@ -447,32 +1868,256 @@ def pdf(name: str, season: str, path: str, next_match_info: dict):
         pdf.Title('No matches left', coords=(20, 30), size=16, color=(0, 51, 102))
 
     # Save PDF
-    pdf.output(f'{name.replace(" ", "_")}_{season}.pdf', 'F')
+    document = pdf.output(dest='S').encode('latin1')
+    if save:
+        with open(f'{name.replace(" ", "_")}_{season}.pdf', 'wb') as file:
+            file.write(document)
+    return document
+
+
+def report(team: str, season: str, df_players: pd.DataFrame, df_schedules: pd.DataFrame,
+           df_player_stats: pd.DataFrame, df_team: pd.DataFrame, executor: ProcessPoolExecutor = None,
+           incremental: bool = False, df_trends: pd.DataFrame = None, stage: str = 'all', vector: bool = False) -> None:
+    """Create the images and the PDF report of a team from its dataframes
+
+    In incremental mode the charts that did not change are not rendered again,
+    and the PDF is only rebuilt when a chart or the next match changed. With
+    the aggregates of several seasons (see get_trends) the trend pages are
+    added. With stage='render' only the images are created, and with
+    stage='pdf' only the PDF, from the images of a previous render. With
+    vector=True the charts are drawn in the PDF as vector graphics, so only
+    the logos are saved as images.
+    """
 
-
-if __name__ == "__main__":
-    # Team Name and Season
-    team = 'BOS'
-    season = '2022'
     path = f'{team}_{season}_images'
 
     # Create a Directory with the Team Code to store the images
     directory(path)
 
-    # Get DataFrames
-    (df_players, df_schedules, df_player_stats, df_team) = get_dfs(team, season)
-
     # Get Team Colors and Name
     (colors, name) = get_team_info(df_team)
 
-    # Get Team Logo
-    web_scraping_nba_logos(name, path)
+    changed = False
+    if stage in ('render', 'all'):
+        # Get Team Logo
+        with record.stage('logo', team=team):
+            web_scraping_nba_logos(name, path)
 
-    # Create Graphs
-    graphs(df_players, df_schedules, df_player_stats, path, colors, name)
+        # Create Graphs
+        if not vector:
+            with record.stage('graphs', team=team):
+                changed = graphs(df_players, df_schedules, df_player_stats, path, colors, name, team, executor, incremental, df_trends)
+    if stage == 'render':
+        return
+
+    # The vector charts are drawn from the data of their jobs
+    jobs = report_jobs(df_players, df_schedules, df_player_stats, colors, name, team, df_trends) if vector else None
 
     # Predict Next Match
+    with record.stage('predict_winner', team=team):
+        next_match_info = predict_winner(name)
+
+    # Create PDF, unless it would be the same as the last one
+    manifest = read_manifest(path)
+    charts = {job[0]: job_hash(job) for job in jobs} if vector else manifest['charts']
+    pdf_hash = hashlib.sha256(repr((name, season, next_match_info, charts, vector)).encode()).hexdigest()
+    pdf_file = f'{name.replace(" ", "_")}_{season}.pdf'
+    if incremental and not changed and manifest['pdf'] == pdf_hash and os.path.exists(pdf_file):
+        return
+    with record.stage('pdf', team=team):
+        pdf(name, season, path, next_match_info, trends=df_trends is not None, jobs=jobs)
+    manifest['pdf'] = pdf_hash
+    write_manifest(path, manifest)
+
+
+def report_bytes(team: str, season: str, df_players: pd.DataFrame, df_schedules: pd.DataFrame,
+                 df_player_stats: pd.DataFrame, df_team: pd.DataFrame, executor: ProcessPoolExecutor = None,
+                 df_trends: pd.DataFrame = None, vector: bool = False) -> bytes:
+    """Create the PDF report of a team in memory, without images directory nor output file
+
+    With vector=True the charts are drawn in the PDF as vector graphics
+    instead of being rendered to PNG.
+    """
+
+    (colors, name) = get_team_info(df_team)
+
+    jobs = report_jobs(df_players, df_schedules, df_player_stats, colors, name, team, df_trends)
+    images = {} if vector else {file_name: image for (file_name, _, _), image in zip(jobs, render_charts(jobs, executor))}
+    images[f'logo_{name.replace(" ", "_")}'] = get_logo(name)
+
     next_match_info = predict_winner(name)
 
-    # Create PDF
-    pdf(name, season, path, next_match_info)
+    return pdf(name, season, f'{team}_{season}_images', next_match_info, images=images, save=False, trends=df_trends is not None,
+               jobs=jobs if vector else None)
+
+
+def shared_report(team: str, season: str, incremental: bool = False, df_trends: pd.DataFrame = None,
+                  vector: bool = False) -> dict:
+    """Create the report of a team in a worker attached to the shared league tables
+
+    Returns the run record of the report, for the parent to merge into its own.
+    """
+
+    global record
+    # The worker creates several reports, each of them is recorded on its own
+    record = RunRecord()
+    report(team, season, *shared_league.team_dfs(team), incremental=incremental, df_trends=df_trends, vector=vector)
+    return record.to_dict()
+
+
+def batch(teams, season: str, workers: int = None, incremental: bool = False, trend_seasons: list = None,
+          vector: bool = False, shared: bool = False, record_file: str = 'run_record.json', full_schedule: bool = False) -> None:
+    """Create the reports of several teams (or 'all') fetching the league-wide data once
+
+    The charts of every team are rendered in a pool of `workers` processes
+    (one per core by default). With trend_seasons the trends of the whole
+    league are streamed once over those seasons and added to every report.
+    With vector=True the charts are drawn in the PDFs as vector graphics.
+    With shared=True the league tables are put once in shared memory and each
+    worker creates whole reports from the rows of its team (see SharedLeague).
+    The schedule is synced incrementally unless full_schedule is True. The run record, with the stages of every report, is saved in record_file.
+    """
+
+    with record.stage('total', teams=teams, season=season):
+        with record.stage('get_league_dfs', season=season):
+            league_dfs = get_league_dfs(season, full_schedule)
+        # We keep the stats of every season in the store for the trend reports
+        save_player_stats(league_dfs[2], season)
+        if teams == 'all':
+            teams = list(league_dfs[3]['Key'])
+
+        df_trends = None
+        if trend_seasons is not None:
+            with record.stage('get_trends', seasons=trend_seasons):
+                df_trends = get_trends(trend_seasons)
+
+        if shared:
+            # The workers read the tables from the segment, so we drop our copy before they start.
+            # They inherit the odds snapshot instead of each of them taking its own
+            league = SharedLeague.create(*league_dfs)
+            del league_dfs
+            odds_board.load()
+            try:
+                with ProcessPoolExecutor(max_workers=workers, initializer=attach_shared_league, initargs=(league.layout,)) as executor:
+                    futures = [executor.submit(shared_report, team, season, incremental,
+                                               df_trends[df_trends['Team'] == team] if df_trends is not None else None, vector)
+                               for team in teams]
+                    for future in futures:
+                        record.merge(future.result())
+            finally:
+                league.close(unlink=True)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                for team in teams:
+                    df_team_trends = df_trends[df_trends['Team'] == team] if df_trends is not None else None
+                    report(team, season, *split_league_dfs(team, *league_dfs), executor=executor, incremental=incremental,
+                           df_trends=df_team_trends, vector=vector)
+
+    record.save(record_file)
+
+
+# Stages of the command line: fetch only downloads the data into the cache and
+# the stores, render only creates the images and pdf only builds the PDF from them
+STAGES = ('fetch', 'render', 'pdf', 'all')
+
+
+def main(team: str, season: str, record_file: str = 'run_record.json', profile_file: str = None,
+         trend_seasons: list = None, stage: str = 'all', vector: bool = False, workers: int = None,
+         full_schedule: bool = False, incremental: bool = True) -> None:
+    """Run a stage of the report of a team, saving the run record and, optionally, a cProfile dump
+
+    With trend_seasons (e.g. ['2019', '2020', '2021', '2022']) the report
+    includes the trend pages over those seasons. The render and pdf stages
+    only read the data saved by a previous fetch, never the network. With
+    vector=True the charts are drawn in the PDF as vector graphics. The
+    charts are rendered in a pool of `workers` processes (one per core by
+    default), only those that changed unless incremental is False, and the
+    schedule is synced incrementally unless full_schedule is True.
+    """
+
+    profiler = cProfile.Profile() if profile_file is not None else None
+    if profiler is not None:
+        profiler.enable()
+
+    # The render and pdf stages read the cache and the game store as the last fetch left them
+    sync = stage not in ('render', 'pdf')
+    if not sync:
+        cache.offline = True
+
+    with record.stage('total', team=team, season=season):
+        with record.stage('get_dfs', team=team):
+            dfs = get_dfs(team, season, full_schedule, sync)
+
+        df_trends = None
+        if trend_seasons is not None:
+            with record.stage('get_trends', team=team):
+                df_trends = get_trends(trend_seasons, team, sync)
+
+        if stage == 'fetch':
+            # We also download the logo and the odds, which the pdf stage reads from disk
+            (colors, name) = get_team_info(dfs[3])
+            with record.stage('logo', team=team):
+                logo_index.file(name)
+            with record.stage('predict_winner', team=team):
+                predict_winner(name)
+        elif stage == 'pdf':
+            report(team, season, *dfs, incremental=incremental, df_trends=df_trends, stage=stage, vector=vector)
+        else:
+            # Create the Report of the Team, rendering in a process pool only the charts that changed
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                report(team, season, *dfs, executor=executor, incremental=incremental, df_trends=df_trends, stage=stage, vector=vector)
+
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(profile_file)
+    record.save(record_file)
+
+
+def parse_args(argv: list = None) -> argparse.Namespace:
+    """Parse the command line of the report"""
+
+    parser = argparse.ArgumentParser(description='PDF reports of NBA teams and a season')
+    parser.add_argument('teams', nargs='+', help="team keys, e.g. BOS, or 'all'. Several teams are created in a batch")
+    parser.add_argument('season', help='season, e.g. 2022')
+    parser.add_argument('--stage', choices=STAGES, default='all',
+                        help='fetch: download the data only, render: create the images only, pdf: build the PDF only')
+    parser.add_argument('--output-dir', default='.', help='directory of the images, the PDF, the run record and the stores')
+    parser.add_argument('--vector', action='store_true', help='draw the charts in the PDF as vector graphics instead of images')
+    parser.add_argument('--trend-seasons', nargs='+', help='add the trend pages over these seasons')
+    parser.add_argument('--workers', type=int, help='processes rendering the charts (one per core by default)')
+    parser.add_argument('--shared', action='store_true', help='batch: put the league tables in shared memory for the workers')
+    parser.add_argument('--full-schedule', action='store_true', help='download the whole schedule instead of syncing it')
+    parser.add_argument('--full-render', action='store_true', help='render every chart and the PDF, even if nothing changed')
+    parser.add_argument('--config', default=CONFIG_FILE, help='file with the API key')
+    parser.add_argument('--cache', default=cache.path, help='directory of the response cache')
+    parser.add_argument('--offline', action='store_true', help='only use the responses in the cache')
+    parser.add_argument('--record', default='run_record.json', help='file of the run record, in the output directory')
+    parser.add_argument('--profile', help='file of the cProfile dump, in the output directory')
+    args = parser.parse_args(argv)
+
+    # The reports of several teams are created by batch, which runs every stage at once
+    args.batch = len(args.teams) > 1 or args.teams == ['all']
+    if args.batch and (args.stage != 'all' or args.profile is not None):
+        parser.error('--stage and --profile only apply to the report of a single team')
+    if not args.batch and args.shared:
+        parser.error('--shared only applies to the reports of several teams')
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    # The paths given on the command line are relative to where it was run,
+    # everything the report writes goes to the output directory
+    CONFIG_FILE = os.path.abspath(args.config)
+    cache = ResponseCache(os.path.abspath(args.cache), offline=args.offline)
+    directory(args.output_dir)
+    os.chdir(args.output_dir)
+
+    # Create the Report of the Team, or those of several teams fetching the league-wide data once
+    if args.batch:
+        batch(args.teams if args.teams != ['all'] else 'all', args.season, args.workers, not args.full_render,
+              args.trend_seasons, args.vector, args.shared, args.record, args.full_schedule)
+    else:
+        main(args.teams[0], args.season, args.record, args.profile, args.trend_seasons, args.stage, args.vector,
+             args.workers, args.full_schedule, not args.full_render)
@@ -0,0 +1,138 @@
+import os
+import re
+import time
+import hashlib
+import argparse
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Long-lived report service: GET /report/{team}/{season}.pdf
+#
+# The reports are built in worker processes that are started once, with
+# pandas, matplotlib and the font cache already loaded. Concurrent requests
+# for the same report wait for the same build, and the finished PDFs are kept
+# in a bounded LRU cache. A cached PDF is served as is for revalidate_after
+# seconds; after that a worker checks whether its data changed and only
+# rebuilds it when it did.
+
+REPORT_PATH = re.compile(r'^/report/([A-Za-z0-9]{2,4})/(\d{4})\.pdf$')
+
+
+def warm_worker() -> None:
+    """Load the libraries of the report and the matplotlib font cache in a new worker"""
+
+    import nba
+    nba.render(nba.figure(figsize=(1, 1)))
+    nba.pd.DataFrame()
+    nba.pdf_class()
+
+
+def build_report(team: str, season: str, known_version: str = None) -> tuple[str, bytes]:
+    """Build the PDF report of a team in a worker
+
+    Returns the version of the data of the report (a hash of every chart's
+    data and the next match) and the PDF, or None instead of the PDF when the
+    version is still known_version.
+    """
+
+    import nba
+
+    # The worker lives for many builds, so each one gets a fresh run record instead of growing the last one
+    nba.record = nba.RunRecord()
+
+    dfs = nba.get_dfs(team, season)
+    (colors, name) = nba.get_team_info(dfs[3])
+    jobs = nba.chart_jobs(*dfs[:3], colors, name, team)
+    next_match_info = nba.predict_winner(name)
+    version = hashlib.sha256(repr(([nba.job_hash(job) for job in jobs], next_match_info)).encode()).hexdigest()
+    if version == known_version:
+        return (version, None)
+    return (version, nba.report_bytes(team, season, *dfs))
+
+
+class ReportService:
+    """Warm worker pool with request coalescing and an LRU cache of finished reports"""
+
+    def __init__(self, workers: int = None, max_reports: int = 64, revalidate_after: float = 60):
+        workers = workers or os.cpu_count() or 1
+        self.executor = ProcessPoolExecutor(max_workers=workers, initializer=warm_worker)
+        # The pool only starts its processes when jobs are submitted, so we start and warm all of
+        # them now, from the main thread, instead of in the first requests
+        for future in [self.executor.submit(os.getpid) for _ in range(workers)]:
+            future.result()
+        self.max_reports = max_reports
+        self.revalidate_after = revalidate_after
+        # (team, season) -> (version, PDF, time of the last check)
+        self.reports = OrderedDict()
+        # (team, season) -> (Future of the build in progress, cached report it revalidates or None)
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def get(self, team: str, season: str) -> bytes:
+        """PDF report of a team, building it at most once for all the concurrent requests"""
+
+        key = (team.upper(), season)
+        with self.lock:
+            cached = self.reports.get(key)
+            if cached is not None and time.time() - cached[2] < self.revalidate_after:
+                self.reports.move_to_end(key)
+                return cached[1]
+            if key not in self.pending:
+                future = self.executor.submit(build_report, key[0], season, cached[0] if cached is not None else None)
+                self.pending[key] = (future, cached)
+            # The requests that join a build use the report it revalidates, as theirs may have been evicted since
+            (future, cached) = self.pending[key]
+
+        try:
+            (version, document) = future.result()
+        finally:
+            with self.lock:
+                if self.pending.get(key, (None,))[0] is future:
+                    del self.pending[key]
+
+        if document is None:
+            # The data did not change, the cached PDF is still valid
+            document = cached[1]
+        with self.lock:
+            self.reports[key] = (version, document, time.time())
+            self.reports.move_to_end(key)
+            while len(self.reports) > self.max_reports:
+                self.reports.popitem(last=False)
+        return document
+
+
+class ReportHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        match = REPORT_PATH.match(self.path)
+        if match is None:
+            self.send_error(404, 'Use /report/{team}/{season}.pdf')
+            return
+        try:
+            document = self.server.service.get(match.group(1), match.group(2))
+        except Exception as error:
+            self.send_error(500, f'Could not build the report: {error}')
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/pdf')
+        self.send_header('Content-Length', str(len(document)))
+        self.end_headers()
+        self.wfile.write(document)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve the NBA team reports over HTTP')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (one per core by default)')
+    parser.add_argument('--max-reports', type=int, default=64, help='finished reports kept in memory')
+    parser.add_argument('--revalidate-after', type=float, default=60,
+                        help='seconds a finished report is served before checking whether its data changed')
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), ReportHandler)
+    server.service = ReportService(args.workers, args.max_reports, args.revalidate_after)
+    print(f'Serving reports on http://{args.host}:{args.port}/report/{{team}}/{{season}}.pdf')
+    server.serve_forever()